@@ -6,17 +6,15 @@ import signal
 import sys
 import time
 
-from prometheus_client.core import REGISTRY
-
-from .collector import AliyunCollector, CollectorConfig
-from .web import create_app
-from .utils import createHttpServer
+from .collector import CollectorConfig, create_collector
+from .exposition import ExpositionCache
+from .server import LazyApplication, createHttpServer
 
 def shutdown():
     logging.info('Shutting down, see you next time!')
     sys.exit(1)
 
-def signal_handler():
+def signal_handler(signum, frame):
     shutdown()
 
 def main():
@@ -30,16 +28,49 @@ def main():
                         help='exporter exposed host(default: "")')
     parser.add_argument('-p', '--port', default=[], action='append',
                         help='exporter exposed port(default: 9525)')
+    parser.add_argument('-w', '--http-workers', default=4, type=int,
+                        help='worker threads for /metrics and for the web UI each(default: 4)')
+    parser.add_argument('--shard-index', default=None, type=int,
+                        help='index of this replica, only its consistent-hash share of the metrics is collected')
+    parser.add_argument('--shard-count', default=None, type=int,
+                        help='number of replicas sharing the metrics(default: 1)')
+    parser.add_argument('--no-web-ui', dest='web_ui', default=None, action='store_false',
+                        help='only serve /metrics, without the metadata web UI')
     args = parser.parse_args()
 
     with open(args.config_file, 'r') as config_file:
         cfg = yaml.load(config_file, Loader=yaml.FullLoader)
+    if args.shard_index is not None:
+        cfg['shard_index'] = args.shard_index
+    if args.shard_count is not None:
+        cfg['shard_count'] = args.shard_count
+    if args.web_ui is not None:
+        cfg['web_ui'] = args.web_ui
     collector_config = CollectorConfig(**cfg)
 
-    collector = AliyunCollector(collector_config)
-    REGISTRY.register(collector)
+    collector = create_collector(collector_config)
+    warm = False
+    if collector_config.persist_path:
+        from .persistence import DiskSnapshot
+        snapshot = DiskSnapshot(collector_config.persist_path, collector_config.persist_interval,
+                                collector_config.persist_max_age)
+        warm = snapshot.load(collector.account_collectors())
+        snapshot.start(collector.account_collectors())
+    collector.start(warm)
 
-    app = create_app(collector_config)
+    exposition = ExpositionCache(collector)
+    app = None
+    if collector_config.web_ui:
+        def create_ui():
+            # the catalog is crawled only once somebody opens the UI, the
+            # project list is published first so the first page is quick
+            from .catalog import MetricCatalog
+            from .web import create_app
+            account = collector.account_collectors()[0]
+            catalog = MetricCatalog(account.client, account.limiter, collector_config.catalog_refresh_interval)
+            catalog.start()
+            return create_app(catalog)
+        app = LazyApplication(create_ui)
 
     if not args.host:
         hosts = ['']
@@ -51,7 +82,15 @@ def main():
         ports = args.port
 
     try:
-        createHttpServer(hosts, ports, app)
+        createHttpServer(hosts, ports, app, exposition, args.http_workers, collector_config.debug_profile)
     except KeyboardInterrupt:
         pass
+    finally:
+        if collector_config.record_path:
+            from .recording import close_recorders
+            close_recorders()
+        # close the pooled aiohttp sessions of every account
+        for account in collector.account_collectors():
+            if account.event_loop is not None:
+                account.event_loop.close()
 
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import threading
+
+import aiohttp
+from aliyunsdkcore.acs_exception import error_code
+from aliyunsdkcore.acs_exception.exceptions import ClientException
+from aliyunsdkcore.client import AcsClient
+
+'''
+EventLoopThread runs one asyncio loop in a daemon thread and owns a pooled,
+keep-alive aiohttp session per endpoint.
+
+All AsyncAcsClient instances sharing a loop also share its sessions, so the
+collector client and every InfoProvider client reuse the same connections.
+'''
+class EventLoopThread():
+
+    def __init__(self, pool_size: int = 100, keepalive_timeout: float = 60):
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.loop = asyncio.new_event_loop()
+        self._sessions = {}
+        self._thread = threading.Thread(target=self._run, name='aliyun-exporter-aio', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coro):
+        '''
+        Run a coroutine on the loop and wait for its result from another thread.
+        '''
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def session(self, endpoint: str):
+        '''
+        Must be called on the loop thread.
+        '''
+        session = self._sessions.get(endpoint, None)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+            # trust_env: honour HTTP_PROXY/HTTPS_PROXY/NO_PROXY like the SDK transport
+            session = aiohttp.ClientSession(connector=connector, auto_decompress=True, trust_env=True)
+            self._sessions[endpoint] = session
+        return session
+
+    async def _close(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+    def close(self):
+        self.run(self._close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+'''
+AsyncAcsClient signs requests exactly like AcsClient, but sends them through
+the pooled keep-alive aiohttp sessions of an EventLoopThread.
+
+It keeps the blocking `do_action_with_exception` interface: the calling pool
+thread waits for the loop, so concurrency is still bounded by `pool_size`,
+what changes is that connections are shared and kept alive between calls.
+'''
+class AsyncAcsClient(AcsClient):
+
+    def __init__(self, ak=None, secret=None, region_id='cn-hangzhou', loop: EventLoopThread = None, **kwargs):
+        super().__init__(ak=ak, secret=secret, region_id=region_id, **kwargs)
+        self.loop = loop or EventLoopThread()
+
+    def _prepare(self, acs_request):
+        acs_request.set_accept_format('JSON')
+        acs_request.add_header('Accept-Encoding', 'identity')
+        endpoint = acs_request.endpoint or self._resolve_endpoint(acs_request)
+        http_response = self._make_http_response(
+            endpoint, acs_request,
+            self._get_request_read_timeout(acs_request),
+            self._get_request_connect_timeout(acs_request))
+        # Same url building as aliyunsdkcore.http.http_response.HttpResponse
+        protocol = 'https://' if http_response.get_ssl_enabled() else 'http://'
+        host = http_response.get_host()
+        if host.startswith('https://') or (not host.startswith('http://') and protocol == 'https://'):
+            port = ':%s' % self._port if self._port not in (80, 443) else ''
+        else:
+            port = ':%s' % self._port if self._port != 80 else ''
+        if not host.startswith('http://') and not host.startswith('https://'):
+            host = protocol + host
+        return endpoint, http_response.get_method(), host + port + http_response.get_url(), \
+            http_response.get_headers(), http_response.get_body()
+
+    async def _send(self, acs_request, endpoint, method, url, headers, body):
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=self._get_request_connect_timeout(acs_request),
+            sock_read=self._get_request_read_timeout(acs_request))
+        try:
+            async with self.loop.session(endpoint).request(
+                    method, url, headers=headers, data=body, timeout=timeout) as resp:
+                status, response_body = resp.status, await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error('HttpError occurred. Host:%s %s' % (endpoint, e))
+            raise ClientException(error_code.SDK_HTTP_ERROR, '%s' % e)
+        exception = self._get_server_exception(status, response_body, endpoint, acs_request.string_to_sign)
+        if exception:
+            raise exception
+        return response_body
+
+    def do_action_with_exception(self, acs_request):
+        return self.loop.run(self._send(acs_request, *self._prepare(acs_request)))
@@ -0,0 +1,118 @@
+import heapq
+import logging
+import threading
+import time
+
+from .scheduler import PeriodScheduler
+
+'''
+SnapshotStore keeps the latest metric families produced by every collect task.
+
+A task is identified by a hashable key, each update replaces the families of
+that key as a whole, so a scrape always sees a complete result of one task.
+'''
+class SnapshotStore():
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots = {}
+        self.version = 0
+
+    def update(self, key, families):
+        families = tuple(families)
+        with self._lock:
+            self._snapshots[key] = families
+            self.version += 1
+
+    def families(self):
+        with self._lock:
+            snapshots = list(self._snapshots.values())
+        for families in snapshots:
+            yield from families
+
+
+'''
+BackgroundEngine polls CloudMonitor out of the scrape path.
+
+Every task is a (key, period, func) tuple, func is submitted to the collector
+pool at the times given by the scheduler and its result is written into the
+snapshot store. A task which is still running when it becomes due again is
+skipped for that round. Tasks listed in `warmup` run once inline before
+anything else, so later tasks can depend on their side effects. With `warm`
+set, the other tasks are all due at start instead of spread by the scheduler.
+'''
+class BackgroundEngine():
+
+    def __init__(self, collector, store: SnapshotStore = None, scheduler: PeriodScheduler = None, warmup=(),
+                 warm: bool = False):
+        self.collector = collector
+        self.warm = warm
+        self.store = store or SnapshotStore()
+        self.scheduler = scheduler or PeriodScheduler()
+        self.warmup = warmup
+        self._queue = []
+        self._running = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._seq = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='aliyun-exporter-background', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def schedule(self, key, period, func, due):
+        with self._lock:
+            self._seq += 1
+            heapq.heappush(self._queue, (due, self._seq, key, period, func))
+        self._wakeup.set()
+
+    def _run(self):
+        for key, period, func in self.collector.tasks():
+            if key in self.warmup:
+                try:
+                    self.store.update(key, func())
+                except Exception as e:
+                    logging.error('Error running background task %s' % (key,), exc_info=e)
+                self.schedule(key, period, func, self.scheduler.next_due(key, period, time.time()))
+            elif self.warm:
+                self.schedule(key, period, func, time.time())
+            else:
+                self.schedule(key, period, func, self.scheduler.first_due(key, period, time.time()))
+        while not self._stopped.is_set():
+            now = time.time()
+            due = []
+            with self._lock:
+                while self._queue and self._queue[0][0] <= now:
+                    due.append(heapq.heappop(self._queue))
+                timeout = self._queue[0][0] - now if self._queue else None
+            for _, _, key, period, func in due:
+                self._submit(key, func)
+                self.schedule(key, period, func, self.scheduler.next_due(key, period, now))
+            if not due:
+                self._wakeup.wait(timeout)
+                self._wakeup.clear()
+
+    def _submit(self, key, func):
+        with self._lock:
+            if key in self._running:
+                logging.warning('Background task %s is still running, skip this round' % (key,))
+                return
+            self._running.add(key)
+        future = self.collector.pool.submit(func)
+        future.add_done_callback(lambda f: self._done(key, f))
+
+    def _done(self, key, future):
+        with self._lock:
+            self._running.discard(key)
+        try:
+            self.store.update(key, future.result())
+        except Exception as e:
+            logging.error('Error running background task %s' % (key,), exc_info=e)
@@ -0,0 +1,168 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .QueryMetricMetaRequest import QueryMetricMetaRequest
+from .QueryProjectMetaRequest import QueryProjectMetaRequest
+from .ratelimiter import RateLimiter
+
+
+def _split(text) -> list:
+    return [s.strip() for s in str(text or '').split(',') if s.strip()]
+
+
+'''
+CatalogIndex is an immutable index of the CloudMonitor metric metadata.
+
+`projects` and the metrics of every project keep the API's order, the
+metrics are also indexed by name, dimension and period for `find`. A
+partial index (`complete` False) only has the projects crawled so far.
+'''
+class CatalogIndex():
+
+    def __init__(self, projects: list, metrics: dict, complete: bool = True):
+        self.projects = projects
+        self.metrics = metrics
+        self.complete = complete
+        self.updated = time.time()
+        self.by_name = {}
+        self.by_dimension = {}
+        self.by_period = {}
+        for project, items in metrics.items():
+            for item in items:
+                entry = (project, item)
+                self.by_name.setdefault(item.get('Metric'), []).append(entry)
+                for dimension in _split(item.get('Dimensions')):
+                    self.by_dimension.setdefault(dimension, []).append(entry)
+                for period in _split(item.get('Periods')):
+                    self.by_period.setdefault(period, []).append(entry)
+
+    def find(self, project: str = None, metric: str = None, dimension: str = None, period: str = None) -> list:
+        '''
+        (project, metric meta) of the metrics matching every given filter.
+        '''
+        if metric:
+            entries = self.by_name.get(metric, [])
+        elif dimension:
+            entries = self.by_dimension.get(dimension, [])
+        elif period:
+            entries = self.by_period.get(str(period), [])
+        elif project:
+            entries = [(project, item) for item in self.metrics.get(project, [])]
+        else:
+            entries = [(p, item) for p, items in self.metrics.items() for item in items]
+        return [(p, item) for p, item in entries
+                if (not project or p == project)
+                and (not dimension or dimension in _split(item.get('Dimensions')))
+                and (not period or str(period) in _split(item.get('Periods')))]
+
+
+'''
+MetricCatalog crawls every page of the project and metric metadata in the
+background and serves it from a CatalogIndex.
+
+Like InfoProvider, a stale index keeps being served while a refresh runs.
+The first crawl publishes partial indexes as it goes, the project list
+first and then every project once its metrics are in, so a request only
+waits for what it needs. Requests go through the shared rate limiter, in
+buckets of their own.
+'''
+class MetricCatalog():
+
+    def __init__(self, client, limiter: RateLimiter = None, refresh_interval: float = 86400,
+                 retry_interval: float = 300, page_size: int = 100):
+        self.client = client
+        self.limiter = limiter
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.page_size = page_size
+        self._index = None
+        self._failed = 0
+        self._pending = None
+        self._lock = threading.Lock()
+        self._published = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='catalog')
+
+    def start(self):
+        self.refresh()
+
+    def refresh(self):
+        with self._lock:
+            if self._pending is None:
+                self._pending = self._executor.submit(self._refresh)
+                self._pending.add_done_callback(lambda _: self._publish(self._index))
+            return self._pending
+
+    def _publish(self, index: CatalogIndex):
+        with self._published:
+            self._index = index
+            self._published.notify_all()
+
+    def _refresh(self) -> CatalogIndex:
+        # a stale complete index keeps being served until the new one is done
+        partial = self._index is None or not self._index.complete
+        try:
+            projects = list(self.pages(QueryProjectMetaRequest))
+            metrics = {}
+            if partial:
+                self._publish(CatalogIndex(projects, {}, complete=False))
+            for project in projects:
+                metrics[project['Project']] = list(self.pages(QueryMetricMetaRequest, project['Project']))
+                if partial:
+                    self._publish(CatalogIndex(projects, dict(metrics), complete=False))
+            index = CatalogIndex(projects, metrics)
+            self._publish(index)
+            return index
+        except Exception as e:
+            self._failed = time.time()
+            logging.error('Error crawling the metric catalog', exc_info=e)
+            raise
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def pages(self, request_class, project: str = None):
+        page = 1
+        while True:
+            req = request_class()
+            req.set_PageSize(self.page_size)
+            req.set_PageNumber(page)
+            if project is not None:
+                req.set_Project(project)
+            if self.limiter is not None:
+                resp = self.limiter.do_action(self.client, req)
+            else:
+                resp = self.client.do_action_with_exception(req)
+            data = json.loads(resp)
+            resources = (data.get('Resources') or {}).get('Resource') or []
+            yield from resources
+            total = int(data.get('Total') or 0)
+            if len(resources) < self.page_size or page * self.page_size >= total:
+                return
+            page += 1
+
+    def index(self, project: str = None) -> CatalogIndex:
+        '''
+        The latest index. Until the first crawl is done, wait for the project
+        list, or for the metrics of `project` when given.
+        '''
+        index = self._index
+        if index is None or not index.complete:
+            future = self.refresh()
+            with self._published:
+                while not self._ready(project):
+                    if future.done():
+                        future.result()
+                        break
+                    self._published.wait()
+                return self._index
+        if time.time() - index.updated > self.refresh_interval and \
+                time.time() - self._failed > self.retry_interval:
+            self.refresh()
+        return index
+
+    def _ready(self, project: str = None) -> bool:
+        index = self._index
+        return index is not None and (index.complete or project is None or project in index.metrics)
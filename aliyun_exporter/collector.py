@@ -1,36 +1,80 @@
+import copy
 import json
 import logging
+import threading
 import time
 import os
 
 from datetime import datetime, timedelta
-from cachetools import cached, TTLCache
+from cachetools import TTLCache
 from prometheus_client.core import GaugeMetricFamily, InfoMetricFamily
+from prometheus_client.samples import Sample
 from aliyunsdkcore.client import AcsClient
-from aliyunsdkcms.request.v20190101 import DescribeMetricLastRequest
-from aliyunsdkrds.request.v20140815 import DescribeDBInstancePerformanceRequest
-from ratelimit import limits, sleep_and_retry
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
+from .background import BackgroundEngine
+from .datapoints import Datapoints
+from .metric_cache import metric_cache, period_ttl
+from .negative_cache import NegativeCache, MetricUnavailable, is_denied
+from .recording import RecordingClient, ReplayClient, open_recorder, open_recording
+from .scheduler import PeriodScheduler
+from .sharding import Shard
 from .info_provider import InfoProvider
-from .utils import try_or_else, requestHistogram, mapInfoByKeys
+from .ratelimiter import RateLimiter
+from .utils import requestHistogram, stageHistogram, seriesGauge, poolQueueGauge, queue_depth, \
+    JoinIndex, merge_families, add_label
 
 rds_performance = 'rds_performance'
 special_namespaces = {
     rds_performance: lambda collector : RDSPerformanceCollector(collector),
 }
 
+# shared by every account of the process, so not overridable per account
+PROCESS_OPTIONS = ('cache_max_entries', 'cache_max_bytes', 'persist_path', 'persist_interval', 'persist_max_age',
+                   'web_ui', 'debug_profile', 'catalog_refresh_interval')
+
+
 class CollectorConfig(object):
     def __init__(self,
                  pool_size=None,
                  rate_limit=10,
                  rate_period=1,
+                 rate_limits=None,
+                 throttle_retries=3,
                  cache_metrics=True,
                  credential=None,
                  metrics=None,
                  info_metrics=None,
-                 protocol_type='http'
+                 protocol_type='http',
+                 background=False,
+                 info_period=60,
+                 info_refresh_interval=3600,
+                 info_incremental=False,
+                 info_full_sync_interval=21600,
+                 schedule_offset=10,
+                 schedule_jitter=20,
+                 transport='sdk',
+                 http_pool_size=100,
+                 page_length=1000,
+                 scrape_freshness=0,
+                 accounts=None,
+                 shard_index=None,
+                 shard_count=None,
+                 shard_peers=None,
+                 cache_max_entries=10000,
+                 cache_max_bytes=256 << 20,
+                 persist_path=None,
+                 persist_interval=60,
+                 persist_max_age=600,
+                 debug_profile=False,
+                 catalog_refresh_interval=86400,
+                 empty_backoff=60,
+                 empty_backoff_max=3600,
+                 record_path=None,
+                 replay_path=None,
+                 replay_speed=1.0,
+                 web_ui=True,
                  ):
         # if metrics is None:
         # raise Exception('Metrics config must be set.')
@@ -40,9 +84,45 @@ class CollectorConfig(object):
         self.pool_size = pool_size or rate_limit
         self.rate_limit = rate_limit
         self.rate_period = rate_period
+        self.rate_limits = rate_limits or {}
+        self.throttle_retries = throttle_retries
         self.cache_metrics = cache_metrics
         self.info_metrics = info_metrics
         self.protocol_type = protocol_type
+        self.background = background
+        self.info_period = info_period
+        self.info_refresh_interval = info_refresh_interval
+        self.info_incremental = info_incremental
+        self.info_full_sync_interval = info_full_sync_interval
+        self.schedule_offset = schedule_offset
+        self.schedule_jitter = schedule_jitter
+        assert transport in ['sdk', 'aio'], 'transport must be "sdk" or "aio"'
+        self.transport = transport
+        self.http_pool_size = http_pool_size
+        self.page_length = page_length
+        self.scrape_freshness = scrape_freshness
+        self.accounts = accounts or []
+        self.account = None
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.shard_peers = shard_peers
+        self.cache_max_entries = cache_max_entries
+        self.cache_max_bytes = cache_max_bytes
+        self.persist_path = persist_path
+        self.persist_interval = persist_interval
+        self.persist_max_age = persist_max_age
+        self.debug_profile = debug_profile
+        self.catalog_refresh_interval = catalog_refresh_interval
+        self.empty_backoff = empty_backoff
+        self.empty_backoff_max = empty_backoff_max
+        assert not (record_path and replay_path), 'record_path and replay_path can not be used together'
+        self.record_path = record_path
+        self.replay_path = replay_path
+        self.replay_speed = replay_speed
+        self.web_ui = web_ui
+        if self.credential is None and self.accounts:
+            # the metadata UI uses the first account
+            self.credential = dict(self.accounts[0].get('credential', {}))
 
         # ENV
         access_id = os.environ.get('ALIYUN_ACCESS_ID')
@@ -50,6 +130,9 @@ class CollectorConfig(object):
         entrypoint = os.environ.get('ALIYUN_ENTRYPOINT')
         protocol_type = os.environ.get('PROTOCOL_TYPE')
         cache_metrics = os.environ.get('CACHE_METRICS')
+        background = os.environ.get('BACKGROUND')
+        shard_index = os.environ.get('SHARD_INDEX')
+        shard_count = os.environ.get('SHARD_COUNT')
         if self.credential is None:
             self.credential = {}
         if access_id is not None and len(access_id) > 0:
@@ -58,197 +141,683 @@ class CollectorConfig(object):
             self.credential['access_key_secret'] = access_secret
         if entrypoint is not None and len(entrypoint) > 0:
             self.credential['entrypoint'] = entrypoint
-        if self.credential['access_key_id'] is None or \
-                self.credential['access_key_secret'] is None:
+        if self.credential.get('access_key_id', None) is None or \
+                self.credential.get('access_key_secret', None) is None:
             raise Exception('Credential is not fully configured.')
         if protocol_type is not None:
             self.protocol_type = protocol_type
         if cache_metrics is not None:
             self.cache_metrics = cache_metrics
+        if background is not None:
+            self.background = background.lower() in ('1', 'true', 'yes', 'on')
+        # only when not given by the file or the --shard-index/--shard-count flags
+        if self.shard_index is None and shard_index is not None and len(shard_index) > 0:
+            self.shard_index = int(shard_index)
+        if self.shard_count is None and shard_count is not None and len(shard_count) > 0:
+            self.shard_count = int(shard_count)
+        self.shard = Shard.from_options(self.shard_index, self.shard_count, self.shard_peers)
+
+    def account_configs(self):
+        '''
+        Yield (name, CollectorConfig) of every configured account. An account
+        must have its own credential, has its own metrics and info_metrics,
+        and may override any other top-level option except the process-wide
+        ones in PROCESS_OPTIONS.
+        '''
+        for i, account in enumerate(self.accounts):
+            config = copy.copy(self)
+            config.accounts = []
+            config.account = account.get('name', 'account%d' % i)
+            config.metrics = None
+            config.info_metrics = None
+            if 'credential' not in account:
+                raise Exception('Credential of account %s is not configured.' % account.get('name', i))
+            for k, v in account.items():
+                if k == 'name':
+                    continue
+                if k in PROCESS_OPTIONS:
+                    raise Exception('Option %s of account %s can only be set at the top level'
+                                    % (k, account.get('name', i)))
+                if not hasattr(config, k):
+                    raise Exception('Unknown option %s in account %s' % (k, account.get('name', i)))
+                setattr(config, k, v)
+            if config.credential.get('access_key_id', None) is None or \
+                    config.credential.get('access_key_secret', None) is None:
+                raise Exception('Credential of account %s is not fully configured.' % account.get('name', i))
+            yield config.account, config
+
+
+def create_collector(config: CollectorConfig):
+    if config.accounts:
+        return MultiAccountCollector(config)
+    return AliyunCollector(config)
+
 
 class AliyunCollector(object):
     def __init__(self, config: CollectorConfig):
         self.metrics = config.metrics or {}
-        self.info_metrics = config.info_metrics
-        self.client = None
+        self.info_metrics = config.info_metrics or {}
+        self.credential = config.credential
+        self.account = config.account
         self.entrypoint = config.credential.get('entrypoint', 'cn-hangzhou')
         self.info_providers = {}
-        self.client = AcsClient(
-            ak=config.credential['access_key_id'],
-            secret=config.credential['access_key_secret'],
-            region_id=self.entrypoint
-        )
+        self.event_loop = None
+        self.record_path = config.record_path
+        self.replay_path = config.replay_path
+        self.replay_speed = config.replay_speed
+        self.limiter = RateLimiter(config.rate_limit, config.rate_period,
+                                   overrides=config.rate_limits, max_retries=config.throttle_retries,
+                                   account=config.account)
+        if config.transport == 'aio':
+            from .aio import EventLoopThread
+            self.event_loop = EventLoopThread(pool_size=config.http_pool_size)
+        self.client = self.create_client(self.entrypoint)
+        self.clients = {self.entrypoint: self.client}
+        self.clients_lock = threading.Lock()
+        # inventories of one account never queue behind another account's crawl
+        self.refresher = ThreadPoolExecutor(max_workers=4, thread_name_prefix='info-refresh')
+        poolQueueGauge.labels('info_refresh', config.account or '').set_function(queue_depth(self.refresher))
         for info, d in self.info_metrics.items():
             for region_id in d.get('region_ids', [self.entrypoint]):
                 if region_id in self.info_providers:
                     client = self.info_providers[region_id]
                 else:
-                    client = InfoProvider(AcsClient(
-                        ak=config.credential['access_key_id'],
-                        secret=config.credential['access_key_secret'],
-                        region_id=region_id
-                    ), config.protocol_type)
+                    client = InfoProvider(self.client_for(region_id), config.protocol_type, self.limiter,
+                                          refresh_interval=config.info_refresh_interval,
+                                          incremental=config.info_incremental,
+                                          full_sync_interval=config.info_full_sync_interval,
+                                          executor=self.refresher, account=config.account)
                     self.info_providers[region_id] = client
                 client.append_info(info)
-        self.limiter = limits(calls=config.rate_limit, period=config.rate_period)
         self.special_collectors = dict()
+        self.pool_size = config.pool_size
         self.pool = ThreadPoolExecutor(max_workers=config.pool_size)
+        poolQueueGauge.labels('collector', config.account or '').set_function(queue_depth(self.pool))
+        self.series = {}
+        self.negative_cache = NegativeCache(config.empty_backoff, config.empty_backoff_max, config.account)
+        self._series_lock = threading.Lock()
         for k, v in special_namespaces.items():
             if k in self.metrics:
                 self.special_collectors[k] = v(self)
         self.cache_metrics = config.cache_metrics
-        self.cache_metric_func = {}
-        self.cache_ext_lables = {}
+        self.page_length = config.page_length
+        self.scrape_freshness = config.scrape_freshness
+        self.shard = config.shard
+        self._flight_lock = threading.Lock()
+        self._flight = None
+        self._last = None
+        self._runs = 0
+        metric_cache.configure(config.cache_max_entries, config.cache_max_bytes)
+        self.info_period = config.info_period
+        self.infos = {}
+        # (version, info families, join indexes), swapped as a whole on inventory change
+        self.info_state = (None, {}, {})
+        self.background = None
+        if config.background:
+            self.background = BackgroundEngine(
+                self,
+                scheduler=PeriodScheduler(config.schedule_offset, config.schedule_jitter),
+                warmup=(('info',),))
+
+    def create_client(self, region_id: str):
+        '''
+        The client of a region. In replay mode it answers from the
+        recording, in record mode every call is recorded.
+        '''
+        if self.replay_path:
+            return ReplayClient(open_recording(self.replay_path), region_id, self.replay_speed)
+        if self.event_loop is not None:
+            from .aio import AsyncAcsClient
+            client = AsyncAcsClient(
+                ak=self.credential['access_key_id'],
+                secret=self.credential['access_key_secret'],
+                region_id=region_id,
+                loop=self.event_loop
+            )
+        else:
+            client = AcsClient(
+                ak=self.credential['access_key_id'],
+                secret=self.credential['access_key_secret'],
+                region_id=region_id
+            )
+        if self.record_path:
+            return RecordingClient(client, open_recorder(self.record_path))
+        return client
+
+    def client_for(self, region_id: str = None):
+        '''
+        The pooled client of a region, shared by metric and info requests.
+        '''
+        if region_id is None:
+            return self.client
+        client = self.clients.get(region_id, None)
+        if client is None:
+            with self.clients_lock:
+                client = self.clients.get(region_id, None)
+                if client is None:
+                    client = self.create_client(region_id)
+                    self.clients[region_id] = client
+        return client
+
+    def account_collectors(self):
+        return [self]
 
-    def _create_cache_method(self, namespace:str, maxsize:int = 3600, period:int = 60):
-        @cached(cache=TTLCache(maxsize=maxsize, ttl=max(5, period - 10)))
-        def cache_metric(*args, **kwargs):
-            return self.query_metric(*args, **kwargs)
-        self.cache_metric_func[namespace] = cache_metric
-        return cache_metric
+    def start(self, warm: bool = False):
+        '''
+        Refresh the inventories which are missing or stale and start the
+        background engine. With `warm` (state restored from disk) every
+        background task runs right away, as its data is likely cached.
+        '''
+        for info_provider in self.info_providers.values():
+            for resource in info_provider.infos:
+                if info_provider.age(resource) > info_provider.refresh_interval:
+                    info_provider.refresh(resource)
+        if self.background is not None:
+            self.background.warm = warm
+            self.background.start()
 
-    def query_metric(self, namespace: str, metric: str, period: int):
+    def cached_metric(self, namespace: str, metric: str, period: int, length: int = 1000, dimensions: str = None,
+                      region_id: str = None) -> Datapoints:
+        '''
+        query_metric through the process-wide metric cache, fresh for
+        `period_ttl` of the period and the latest datapoint.
+        '''
+        key = (self.credential['access_key_id'], region_id or self.entrypoint, namespace, metric, period, length,
+               dimensions)
+        return metric_cache.get(
+            key,
+            lambda: self.query_metric(namespace, metric, period, length, dimensions, region_id),
+            lambda points: period_ttl(period, points.last_timestamp()))
+
+    def query_metric_pages(self, namespace: str, metric: str, period: int, length: int = 1000, dimensions: str = None,
+                           region_id: str = None):
+        '''
+        Yield the datapoints of a metric page by page, following NextToken.
+        '''
+        from aliyunsdkcms.request.v20190101.DescribeMetricLastRequest import DescribeMetricLastRequest
         histogram = requestHistogram.labels(namespace, False)
         limithistogram = requestHistogram.labels(namespace, True)
-        
-        @limithistogram.time()  # 限速后的请求时间
-        @sleep_and_retry        # 等待并重试
-        @self.limiter           # 限速
+        request_stage = stageHistogram.labels('request', namespace)
+        wait_stage = stageHistogram.labels('wait', namespace)
+        decode_stage = stageHistogram.labels('decode', namespace)
+        client = self.client_for(region_id)
+        bucket = self.limiter.bucket('Cms.DescribeMetricLast', client.get_region_id())
+
+        requested = [0]
+
         @histogram.time()       # 真实请求时间
+        def _do_action(req):
+            start = time.perf_counter()
+            try:
+                return client.do_action_with_exception(req)
+            finally:
+                requested[0] += time.perf_counter() - start
+
+        @limithistogram.time()  # 限速后的请求时间
         def _fetch_metric(req):
-            return self.client.do_action_with_exception(req)
-        req = DescribeMetricLastRequest.DescribeMetricLastRequest()
-        req.set_Namespace(namespace)
-        req.set_MetricName(metric)
-        req.set_Period(period)
-        # start_time = time.time()
-        try:
-            resp = _fetch_metric(req)
-        except Exception as e:
-            logging.error('Error request cloud monitor api', exc_info=e)
-            return []
-        data = json.loads(resp)
-        if 'Datapoints' in data:
-            points = json.loads(data['Datapoints'])
-            return points
-        else:
-            logging.error('Error query metrics for {}_{}, the response body don not have Datapoints field, please check you permission or workload' .format(namespace, metric))
-            return []
+            requested[0] = 0
+            start = time.perf_counter()
+            try:
+                return self.limiter.call(bucket, _do_action, req)  # 限速, 被限流时退避重试
+            finally:
+                request_stage.observe(requested[0])
+                wait_stage.observe(time.perf_counter() - start - requested[0])
+        next_token = None
+        while True:
+            req = DescribeMetricLastRequest()
+            req.set_Namespace(namespace)
+            req.set_MetricName(metric)
+            req.set_Period(period)
+            req.set_Length(length)
+            if dimensions:
+                req.set_Dimensions(dimensions)
+            if next_token:
+                req.set_NextToken(next_token)
+            try:
+                resp = _fetch_metric(req)
+            except Exception as e:
+                if is_denied(e):
+                    raise MetricUnavailable('denied', str(e))
+                logging.error('Error request cloud monitor api', exc_info=e)
+                raise
+            with decode_stage.time():
+                data = json.loads(resp)
+                del resp
+                points = json.loads(data['Datapoints'] or '[]') if 'Datapoints' in data else None
+            if points is None:
+                logging.error('Error query metrics for {}_{}, the response body don not have Datapoints field, please check you permission or workload' .format(namespace, metric))
+                raise MetricUnavailable('denied' if str(data.get('Code', '')) == '403' else 'no_datapoints')
+            yield points
+            next_token = data.get('NextToken', None)
+            if not next_token:
+                return
 
-    def parse_label_keys(self, point):
-        return [k for k in point if k not in ['timestamp', 'Maximum', 'Minimum', 'Average', 'Value', 'userId']]
+    def query_metric(self, namespace: str, metric: str, period: int, length: int = 1000, dimensions: str = None,
+                     region_id: str = None) -> Datapoints:
+        points = Datapoints()
+        for page in self.query_metric_pages(namespace, metric, period, length, dimensions, region_id):
+            points.extend(page)
+        return points
 
     def format_metric_name(self, namespace, name):
         return 'aliyun_{}_{}'.format(namespace, name)
 
-    def metric_generator(self, namespace, metric, info_keymap = {}, info = None, ext_keys = []):
+    def request_key(self, metric):
+        '''
+        The DescribeMetricLast call a metric item needs, as a hashable key.
+        '''
         if 'name' not in metric:
             raise Exception('name must be set in metric item.')
-        name = metric['name']
-        metric_name = metric['name']
-        period = 60
-        measure = 'Average'
-        if 'rename' in metric:
-            name = metric['rename']
-        if 'period' in metric:
-            period = metric['period']
-        if 'measure' in metric:
-            measure = metric['measure']
-
-        func = self.cache_metric_func.get(namespace, None if self.cache_metrics else self.query_metric)
-        if not callable(func) and self.cache_metrics:
-            func = self._create_cache_method(namespace, period=period)
-        try:
-            points = func(namespace, metric_name, period)
-        except Exception as e:
-            logging.error('Error query metrics for {}_{}'.format(namespace, metric_name), exc_info=e)
-            return (metric_up_gauge(self.format_metric_name(namespace, name), False),)
-        if len(points) < 1:
-            return (metric_up_gauge(self.format_metric_name(namespace, name), False),)
-        point_keys = self.parse_label_keys(points[0])
-        label_keys = []
-        label_keys.extend(point_keys)
-        ext_lables = self.cache_ext_lables.get('_'.join([namespace, metric_name]), None)
-        if not ext_lables and (info and ext_keys and info_keymap):
-            for ek in ext_keys:
-                if isinstance(ek, dict):
-                    label_keys.extend(ek.values())
-                else:
-                    label_keys.append(ek)
-            ext_lables = mapInfoByKeys(list(filter(bool,map(lambda x:info_keymap.get(x, None), point_keys))), info, ext_keys)
-            self.cache_ext_lables['_'.join([namespace, metric_name])] = ext_lables
-        gauge = GaugeMetricFamily(self.format_metric_name(namespace, name), '', labels=label_keys)
-        for point in points:
-            if measure not in point:
-                raise KeyError('Measure %s is not in datapoint %s_%s. Which have keys: [%s]' % (measure, namespace, name, ', '.join(point.keys())))
-            timestamp = point.get('timestamp', None)
-            if isinstance(timestamp, (int, float)):
-                timestamp = timestamp / 1000
-            point_labels = [try_or_else(lambda: str(point[k]), '') for k in point_keys]
-            if info and ext_keys and info_keymap:
-                map_labels = [try_or_else(lambda: str(point[k]), '') for k in point_keys if k in info_keymap.keys()]
-                point_labels.extend(ext_lables.get(','.join(map_labels), []))
-            gauge.add_metric(point_labels, point[measure], timestamp=timestamp)
-        return (gauge, metric_up_gauge(self.format_metric_name(namespace, name), True))
+        dimensions = metric.get('dimensions', None)
+        if dimensions is not None and not isinstance(dimensions, str):
+            dimensions = json.dumps(dimensions, sort_keys=True)
+        return (metric['name'], metric.get('period', 60), metric.get('length', self.page_length), dimensions)
 
-    def collect(self):
-        futures = []
-        info_futures = []
+    def plan_requests(self, namespace):
+        '''
+        Group the metric items of a namespace by the request they need. Items
+        which only differ by rename or measure share a single API call.
+        '''
+        groups = {}
+        for metric in self.metrics[namespace].get('metrics', []):
+            groups.setdefault(self.request_key(metric), []).append(metric)
+        return groups
+
+    def metric_generator(self, namespace, metric, info_keymap = {}, fromInfo = None, ext_keys = [], region_id = None):
+        return self.group_generator(namespace, [metric], info_keymap, fromInfo, ext_keys, region_id)
+
+    def join_index(self, fromInfo, info_keys, ext_keys):
+        '''
+        The JoinIndex of an info metric for the current inventory version.
+        It is built at most once per version and shared by all metrics.
+        '''
+        _, infos, indexes = self.info_state
+        info = infos.get(fromInfo, None)
+        if info is None:
+            return None
+        key = (fromInfo, tuple(info_keys), repr(ext_keys))
+        index = indexes.get(key, None)
+        if index is None:
+            index = JoinIndex(info, info_keys, ext_keys)
+            indexes[key] = index
+        return index
+
+    def group_generator(self, namespace, metrics, info_keymap = {}, fromInfo = None, ext_keys = [], region_id = None):
+        '''
+        Query one request group, with `region_id` set the families carry a
+        `region` label.
+        '''
+        metric_name, period, length, dimensions = self.request_key(metrics[0])
+        names = [(metric.get('rename', metric_name), metric.get('measure', 'Average')) for metric in metrics]
+
+        def failed():
+            return tuple(metric_up_gauge(self.format_metric_name(namespace, name), False, region_id)
+                         for name, _ in names)
+
+        negative_key = (namespace, metric_name, region_id or self.entrypoint)
+        if self.negative_cache.suppressed(negative_key):
+            return failed()
+        unavailable = []
+
+        def guarded(pages):
+            # keep the pages received before an error, they are exported with _up 0
+            try:
+                yield from pages
+            except MetricUnavailable as e:
+                unavailable.append(e.reason)
+            except Exception as e:
+                logging.error('Error query metrics for {}_{}'.format(namespace, metric_name), exc_info=e)
+                unavailable.append(None)
+
+        if self.cache_metrics:
+            try:
+                pages = (self.cached_metric(namespace, metric_name, period, length, dimensions, region_id),)
+            except MetricUnavailable as e:
+                self.negative_cache.failed(negative_key, e.reason)
+                return failed()
+            except Exception as e:
+                logging.error('Error query metrics for {}_{}'.format(namespace, metric_name), exc_info=e)
+                return failed()
+        else:
+            # Without cache, turn every page into samples as soon as it arrives
+            pages = guarded(self.query_metric_pages(namespace, metric_name, period, length, dimensions, region_id))
+        enrich = bool(fromInfo and ext_keys and info_keymap)
+        enrich_stage = stageHistogram.labels('enrich', namespace)
+        build_stage = stageHistogram.labels('build', namespace)
+        label_keys = None
+        index = None
+        gauges = None
+        for points in pages:
+            if not isinstance(points, Datapoints):
+                points = Datapoints(label_keys).extend(points)
+            if not len(points):
+                continue
+            if gauges is None:
+                label_keys = points.label_keys
+                names_keys = list(label_keys)
+                if enrich:
+                    join_columns = [i for i, k in enumerate(label_keys) if k in info_keymap]
+                    index = self.join_index(fromInfo, [info_keymap[label_keys[i]] for i in join_columns], ext_keys)
+                if index is not None:
+                    names_keys.extend(index.label_names)
+                if region_id is not None:
+                    names_keys.append('region')
+                gauges = [GaugeMetricFamily(self.format_metric_name(namespace, name), '', labels=names_keys)
+                          for name, _ in names]
+            rows = points.labels
+            if index is not None:
+                with enrich_stage.time():
+                    rows = [labels + index.lookup(tuple(labels[i] for i in join_columns)) for labels in rows]
+            with build_stage.time():
+                if region_id is not None:
+                    rows = [labels + (region_id,) for labels in rows]
+                timestamps = [points.timestamp(i) for i in range(len(points))]
+                for gauge, (name, measure) in zip(gauges, names):
+                    try:
+                        values = points.column(measure)
+                    except KeyError as e:
+                        raise KeyError('%s_%s: %s' % (namespace, name, e))
+                    samples = gauge.samples
+                    for labels, value, timestamp in zip(rows, values, timestamps):
+                        samples.append(Sample(gauge.name, dict(zip(names_keys, labels)), value, timestamp))
+        if gauges is None:
+            reason = unavailable[0] if unavailable else 'no_datapoints'
+            if reason is not None:
+                self.negative_cache.failed(negative_key, reason)
+            return failed()
+        # an error after some pages: the series are incomplete, say so in _up
+        complete = not unavailable
+        if complete:
+            self.negative_cache.succeeded(negative_key)
+        families = []
+        for gauge, (name, _) in zip(gauges, names):
+            families.append(gauge)
+            families.append(metric_up_gauge(self.format_metric_name(namespace, name), complete, region_id))
+        return tuple(families)
+
+    def refresh_infos(self):
+        providers = []
         if self.info_metrics != None:
             for resource in self.info_metrics.keys():
                 for info_provider in self.info_providers.values():
                     if info_provider.has(resource):
-                        info_futures.append(self.pool.submit(info_provider.get_metrics, resource))
+                        providers.append((info_provider, resource))
+        # providers load on their own refresher pool, never on self.pool: in
+        # background mode this runs as a task of self.pool and would wait for
+        # a free worker of its own pool
+        for info_provider, resource in providers:
+            info_provider.prefetch(resource)
+        results = []
+        for info_provider, resource in providers:
+            try:
+                results.append(info_provider.get_metrics(resource))
+            except Exception:
+                # never loaded, logged by the provider and retried on the next call
+                continue
+        version = tuple(sorted(d.get('version', 0) for d in results))
+        if version == self.info_state[0]:
+            return list(self.infos.values())
         infos = {}
-        for future in as_completed(info_futures):
-            d = future.result()
+        for d in results:
             if not d['labels']:
                 continue
             i = infos.get(d['name'],InfoMetricFamily('aliyun_meta_'+d['name'], d['desc'], labels=d['labels']))
             for info in d['infos']:
                 i.add_metric([], info)
             infos[d['name']] = i
+        self.info_state = (version, infos, {})
+        self.infos = infos
+        return list(infos.values())
+
+    def metric_task(self, namespace, metrics, region_id=None):
+        extra_labels = self.metrics[namespace].get('extra_labels', {})
+        fromInfo = None
+        labels = None
+        keys = None
+        if extra_labels:
+            fromInfo = extra_labels.get('fromInfo', None)
+            labels = extra_labels.get('labels', [])
+            keys = extra_labels.get('keys', {})
+        if fromInfo and labels and keys:
+            return lambda: self.group_generator(namespace, metrics, keys, fromInfo, labels, region_id)
+        return lambda: self.group_generator(namespace, metrics, region_id=region_id)
+
+    def counted(self, key, func):
+        '''
+        Wrap a task to time it and keep the series count of its namespace.
+        '''
+        namespace = key[0]
+        stage = stageHistogram.labels('task', namespace)
+
+        def task():
+            with stage.time():
+                families = func()
+            with self._series_lock:
+                self.series[key] = sum(len(f.samples) for f in families)
+                total = sum(n for k, n in self.series.items() if k[0] == namespace)
+            seriesGauge.labels(namespace, self.account or '').set(total)
+            return families
+        return task
+
+    def owns(self, *unit) -> bool:
+        '''
+        Whether the work unit belongs to this replica's shard.
+        '''
+        if self.shard is None:
+            return True
+        return self.shard.owns('/'.join(str(u) for u in (self.account,) + unit))
+
+    def tasks(self):
+        '''
+        Yield every unit of collect work as (key, period, func). A namespace
+        with `region_ids` has one unit per region and request. In shard mode
+        only the units owned by this replica are yielded, the inventory is
+        always refreshed since every replica needs it for labels.
+        '''
+        if self.info_metrics != None:
+            yield ('info',), self.info_period, self.refresh_infos
         for namespace in self.metrics:
             if namespace in special_namespaces:
-                futures.append(self.pool.submit(self.special_collectors[namespace].collect))
+                if not self.owns(namespace):
+                    continue
+                collector = self.special_collectors[namespace]
+                yield (namespace,), collector.period, \
+                    self.counted((namespace,), lambda collector=collector: list(collector.collect()))
                 continue
-            metrics = self.metrics[namespace].get('metrics', [])
-            extra_labels = self.metrics[namespace].get('extra_labels', {})
-            fromInfo = None
-            labels = None
-            keys = None
-            if extra_labels:
-                fromInfo = extra_labels.get('fromInfo', None)
-                labels = extra_labels.get('labels', [])
-                keys = extra_labels.get('keys', {})
-            for metric in metrics:
-                if fromInfo and labels and keys:
-                    futures.append(self.pool.submit(self.metric_generator, namespace, metric, keys, infos[fromInfo], labels))
-                else:
-                    futures.append(self.pool.submit(self.metric_generator, namespace, metric))
+            region_ids = self.metrics[namespace].get('region_ids', None) or [None]
+            for request_key, metrics in self.plan_requests(namespace).items():
+                for region_id in region_ids:
+                    if not self.owns(namespace, request_key[0], region_id or self.entrypoint):
+                        continue
+                    key = (namespace, region_id) + request_key
+                    yield key, request_key[1], self.counted(key, self.metric_task(namespace, metrics, region_id))
+
+    def snapshot(self):
+        '''
+        Return (version, families). The version changes whenever the families
+        do. In background mode it is the snapshot store version, otherwise
+        the number of the collection run the families come from.
+        '''
+        if self.background is not None:
+            return self.background.store.version, merge_families(self.background.store.families())
+        return self.coalesce()
+
+    def coalesce(self):
+        '''
+        Single-flight collection: callers arriving while a collection runs
+        wait for its result, and a result younger than `scrape_freshness`
+        seconds is reused without collecting again.
+        '''
+        with self._flight_lock:
+            if self._last is not None and time.time() - self._last[0] <= self.scrape_freshness:
+                return self._last[1:]
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = Future()
+        if leader:
+            try:
+                families = list(merge_families(self.collect_all()))
+                with self._flight_lock:
+                    self._runs += 1
+                    self._last = (time.time(), self._runs, families)
+                flight.set_result((self._runs, families))
+            except Exception as e:
+                flight.set_exception(e)
+            finally:
+                with self._flight_lock:
+                    self._flight = None
+        return flight.result()
+
+    def collect_all(self):
+        futures = []
+        infos = self.refresh_infos()
+        for key, _, func in self.tasks():
+            if key == ('info',):
+                continue
+            futures.append(self.pool.submit(func))
         for future in as_completed(futures):
             yield from future.result()
-        yield from infos.values()
+        yield from infos
+
+    def collect(self):
+        yield from self.snapshot()[1]
 
 
-def metric_up_gauge(resource: str, succeeded=True):
+'''
+MultiAccountCollector serves several Aliyun accounts from one process.
+
+Every account is an AliyunCollector of its own, so rate limit buckets,
+caches and the worker pool are isolated and one busy account can't starve
+the others. Accounts are collected in parallel and every series gets an
+`account` label.
+'''
+class MultiAccountCollector(object):
+
+    def __init__(self, config: CollectorConfig):
+        self.collectors = [(name, AliyunCollector(c)) for name, c in config.account_configs()]
+        self.pool = ThreadPoolExecutor(max_workers=max(1, len(self.collectors)))
+        # last families of every account, served when its collection fails
+        self._last = {}
+
+    def account_collectors(self):
+        return [collector for _, collector in self.collectors]
+
+    def start(self, warm: bool = False):
+        for _, collector in self.collectors:
+            collector.start(warm)
+
+    def snapshot(self):
+        '''
+        (version, families) of every account. An account whose collection
+        fails keeps its last families and reports aliyun_account_up 0, the
+        other accounts are not affected.
+        '''
+        futures = [(name, self.pool.submit(self._account_snapshot, collector)) for name, collector in self.collectors]
+        snapshots = []
+        for name, future in futures:
+            try:
+                version, account_families = future.result()
+                self._last[name] = account_families
+                snapshots.append((name, version, account_families, True))
+            except Exception as e:
+                logging.error('Error collecting account %s' % name, exc_info=e)
+                snapshots.append((name, None, self._last.get(name, []), False))
+        if any(version is None for _, version, _, _ in snapshots):
+            version = None
+        else:
+            version = tuple(version for _, version, _, _ in snapshots)
+
+        def families():
+            for name, _, account_families, succeeded in snapshots:
+                yield from add_label(account_families, 'account', name)
+                yield from add_label([metric_up_gauge('aliyun_account', succeeded)], 'account', name)
+        return version, merge_families(families())
+
+    @staticmethod
+    def _account_snapshot(collector: AliyunCollector):
+        # families are materialized here, so errors surface in this account's future
+        version, families = collector.snapshot()
+        return version, list(families)
+
+    def collect(self):
+        yield from self.snapshot()[1]
+
+
+def metric_up_gauge(resource: str, succeeded=True, region_id=None):
     metric_name = resource + '_up'
     description = 'Did the {} fetch succeed.'.format(resource)
-    return GaugeMetricFamily(metric_name, description, value=int(succeeded))
+    if region_id is None:
+        return GaugeMetricFamily(metric_name, description, value=int(succeeded))
+    gauge = GaugeMetricFamily(metric_name, description, labels=['region'])
+    gauge.add_metric([region_id], int(succeeded))
+    return gauge
 
 
+'''
+RDSPerformanceCollector collects the `rds_performance` special namespace.
+
+Instances are discovered from the rds info of every region. The configured
+keys are split into chunks of `key_chunk_size`, every (instance, chunk) is
+one DescribeDBInstancePerformance call on a bounded pool under the shared
+limiter, cached for `period` seconds. Samples are aggregated into a single
+family per metric name.
+'''
 class RDSPerformanceCollector:
 
+    key_chunk_size = 10
+    period = 60
+
     def __init__(self, delegate: AliyunCollector):
         self.parent = delegate
+        self.pool = ThreadPoolExecutor(max_workers=delegate.pool_size)
+        poolQueueGauge.labels('rds_performance', delegate.account or '').set_function(queue_depth(self.pool))
+        self.cache = TTLCache(maxsize=100000, ttl=self.period)
+        self.cache_lock = threading.Lock()
+
+    def metric_keys(self):
+        metrics = self.parent.metrics[rds_performance]
+        if isinstance(metrics, dict):
+            metrics = metrics.get('metrics', [])
+        return [metric['name'] for metric in metrics]
+
+    def instances(self):
+        '''
+        Yield (info_provider, DBInstanceId) of every region having rds info.
+        '''
+        for info_provider in self.parent.info_providers.values():
+            if not info_provider.has('rds'):
+                continue
+            try:
+                infos = info_provider.get_metrics('rds')['infos']
+            except Exception as e:
+                logging.error('Error get rds instances of %s' % info_provider.client.get_region_id(), exc_info=e)
+                continue
+            for info in infos:
+                if info.get('DBInstanceId', None):
+                    yield info_provider, info['DBInstanceId']
 
     def collect(self):
-        for id in [s.labels['DBInstanceId'] for s in self.parent.info_provider.get_metrics('rds').samples]:
-            metrics = self.query_rds_performance_metrics(id)
-            for metric in metrics:
-                yield from self.parse_rds_performance(id, metric)
+        keys = self.metric_keys()
+        chunks = [','.join(keys[i:i + self.key_chunk_size]) for i in range(0, len(keys), self.key_chunk_size)]
+        futures = {}
+        for info_provider, id in self.instances():
+            for chunk in chunks:
+                futures[self.pool.submit(self.cached_rds_performance_metrics, info_provider.client, id, chunk)] = id
+        gauges = {}
+        for future in as_completed(futures):
+            id = futures[future]
+            for metric in future.result():
+                for name, value in self.parse_rds_performance(metric):
+                    gauge = gauges.get(name, None)
+                    if gauge is None:
+                        gauge = GaugeMetricFamily(self.parent.format_metric_name(rds_performance, name), '',
+                                                  labels=['instanceId'])
+                        gauges[name] = gauge
+                    gauge.add_metric([id], value)
+        return gauges.values()
 
-    def parse_rds_performance(self, id, value):
+    def parse_rds_performance(self, value):
         value_format: str = value['ValueFormat']
         metric_name = value['Key']
         keys = ['value']
@@ -257,25 +826,32 @@ class RDSPerformanceCollector:
         metric = value['Values']['PerformanceValue']
         if len(metric) < 1:
             return
-        values = metric[0]['Value'].split('&')
+        values = metric[-1]['Value'].split('&')
         for k, v in zip(keys, values):
-            gauge = GaugeMetricFamily(
-                self.parent.format_metric_name(rds_performance, metric_name + '_' + k),
-                '', labels=['instanceId'])
-            gauge.add_metric([id], float(v))
-            yield gauge
-
-    def query_rds_performance_metrics(self, id):
-        req = DescribeDBInstancePerformanceRequest.DescribeDBInstancePerformanceRequest()
+            yield metric_name + '_' + k, float(v)
+
+    def cached_rds_performance_metrics(self, client, id, keys):
+        with self.cache_lock:
+            metrics = self.cache.get((id, keys), None)
+        if metrics is None:
+            metrics = self.query_rds_performance_metrics(client, id, keys)
+            with self.cache_lock:
+                self.cache[(id, keys)] = metrics
+        return metrics
+
+    def query_rds_performance_metrics(self, client, id, keys):
+        from aliyunsdkrds.request.v20140815.DescribeDBInstancePerformanceRequest import \
+            DescribeDBInstancePerformanceRequest
+        req = DescribeDBInstancePerformanceRequest()
         req.set_DBInstanceId(id)
-        req.set_Key(','.join([metric['name'] for metric in self.parent.metrics[rds_performance]]))
+        req.set_Key(keys)
         now = datetime.utcnow();
         now_str = now.replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%MZ")
         one_minute_ago_str = (now - timedelta(minutes=1)).replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%MZ")
         req.set_StartTime(one_minute_ago_str)
         req.set_EndTime(now_str)
         try:
-            resp = self.parent.client.do_action_with_exception(req)
+            resp = self.parent.limiter.do_action(client, req)
         except Exception as e:
             logging.error('Error request rds performance api', exc_info=e)
             return []
@@ -0,0 +1,106 @@
+import json
+import math
+import struct
+import sys
+from array import array
+
+MEASURES = ('Average', 'Maximum', 'Minimum', 'Value')
+NOT_LABELS = ('timestamp', 'userId') + MEASURES
+
+
+def _float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+'''
+Datapoints is the columnar form of a DescribeMetricLast response.
+
+Label values are kept as one tuple of interned strings per row, timestamps
+(in seconds) and every measure in `array('d')` columns. Rows missing a
+measure hold NaN. `label_keys` come from the first datapoint, like the
+labels of the families built from it.
+'''
+class Datapoints():
+
+    __slots__ = ('label_keys', 'labels', 'timestamps', 'columns')
+
+    def __init__(self, label_keys: tuple = None):
+        self.label_keys = label_keys
+        self.labels = []
+        self.timestamps = array('d')
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def extend(self, points: list):
+        if not points:
+            return self
+        if self.label_keys is None:
+            self.label_keys = tuple(sys.intern(k) for k in points[0] if k not in NOT_LABELS)
+        for measure in MEASURES:
+            if measure not in self.columns and any(measure in point for point in points):
+                self.columns[measure] = array('d', [math.nan]) * len(self.labels)
+        intern = sys.intern
+        label_keys = self.label_keys
+        for point in points:
+            self.labels.append(tuple(intern(str(point.get(k, ''))) for k in label_keys))
+            timestamp = point.get('timestamp', None)
+            self.timestamps.append(timestamp / 1000 if isinstance(timestamp, (int, float)) else math.nan)
+            for measure, column in self.columns.items():
+                column.append(_float(point.get(measure, math.nan)))
+        return self
+
+    def column(self, measure: str):
+        '''
+        Values of a measure, a label can be used as measure as well.
+        '''
+        column = self.columns.get(measure, None)
+        if column is not None:
+            return column
+        if measure in self.label_keys:
+            i = self.label_keys.index(measure)
+            return array('d', (_float(labels[i]) for labels in self.labels))
+        raise KeyError('Measure %s is not in datapoints. Which have keys: [%s]'
+                       % (measure, ', '.join(self.label_keys + tuple(self.columns))))
+
+    @property
+    def nbytes(self) -> int:
+        '''
+        Estimated size, label strings are interned and not counted.
+        '''
+        row = sys.getsizeof(()) + 8 * len(self.label_keys or ()) + 8
+        columns = sum(len(c) * c.itemsize for c in self.columns.values())
+        return len(self.labels) * row + len(self.timestamps) * 8 + columns
+
+    def last_timestamp(self):
+        timestamps = [t for t in self.timestamps if not math.isnan(t)]
+        return max(timestamps) if timestamps else None
+
+    def dumps(self) -> bytes:
+        header = json.dumps({'label_keys': self.label_keys, 'labels': self.labels,
+                             'columns': list(self.columns)}).encode('utf-8')
+        body = [self.timestamps.tobytes()] + [c.tobytes() for c in self.columns.values()]
+        return struct.pack('<I', len(header)) + header + b''.join(body)
+
+    @classmethod
+    def loads(cls, data: bytes) -> 'Datapoints':
+        size, = struct.unpack_from('<I', data)
+        header = json.loads(data[4:4 + size])
+        label_keys = header['label_keys']
+        points = cls(tuple(sys.intern(k) for k in label_keys) if label_keys is not None else None)
+        points.labels = [tuple(sys.intern(v) for v in labels) for labels in header['labels']]
+        width = len(points.labels) * points.timestamps.itemsize
+        offset = 4 + size
+        points.timestamps.frombytes(data[offset:offset + width])
+        for measure in header['columns']:
+            offset += width
+            points.columns[measure] = array('d', data[offset:offset + width])
+        return points
+
+    def timestamp(self, i: int):
+        timestamp = self.timestamps[i]
+        return None if math.isnan(timestamp) else timestamp
@@ -0,0 +1,69 @@
+import gzip
+import threading
+
+from prometheus_client import exposition
+from prometheus_client.core import REGISTRY
+from prometheus_client.exposition import generate_latest
+
+from .utils import stageHistogram
+
+CONTENT_TYPE = getattr(exposition, 'CONTENT_TYPE_PLAIN_0_0_4', exposition.CONTENT_TYPE_LATEST)
+encodeStage = stageHistogram.labels('encode', '')
+
+class _Families():
+
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+
+'''
+ExpositionCache keeps the encoded text exposition of a collector.
+
+The collector's `snapshot()` returns (version, families), the text and gzip
+payloads are only regenerated when the version changes. A None version is
+rendered on every call.
+'''
+class ExpositionCache():
+
+    def __init__(self, collector):
+        self.collector = collector
+        self._lock = threading.Lock()
+        self._version = None
+        self._text = None
+        self._gzip = None
+
+    def render(self, compress: bool = False) -> bytes:
+        version, families = self.collector.snapshot()
+        if version is None:
+            with encodeStage.time():
+                text = generate_latest(_Families(families))
+                return gzip.compress(text) if compress else text
+        with self._lock:
+            if version != self._version:
+                with encodeStage.time():
+                    self._text = generate_latest(_Families(families))
+                self._gzip = None
+                self._version = version
+            if compress and self._gzip is None:
+                with encodeStage.time():
+                    self._gzip = gzip.compress(self._text)
+            return self._gzip if compress else self._text
+
+
+def render_metrics(cache: ExpositionCache, compress: bool, registry=REGISTRY):
+    '''
+    Headers and body chunks of a /metrics response: the process metrics of
+    `registry` followed by the cached exposition. Gzip members can be
+    concatenated, so only the small registry part is compressed per request.
+    '''
+    own = generate_latest(registry)
+    if compress:
+        own = gzip.compress(own)
+    body = cache.render(compress)
+    headers = [('Content-Type', CONTENT_TYPE), ('Content-Length', str(len(own) + len(body)))]
+    if compress:
+        headers.append(('Content-Encoding', 'gzip'))
+    return headers, [own, body]
@@ -1,15 +1,17 @@
+import hashlib
+import itertools
 import json
+import logging
+import threading
+import time
 
 from aliyunsdkcore.client import AcsClient
-from cachetools import cached, TTLCache
+from concurrent.futures import ThreadPoolExecutor
+from prometheus_client import Gauge
 
-import aliyunsdkecs.request.v20140526.DescribeInstancesRequest as DescribeECS
-import aliyunsdkrds.request.v20140815.DescribeDBInstancesRequest as DescribeRDS
-import aliyunsdkr_kvstore.request.v20150101.DescribeInstancesRequest as DescribeRedis
-import aliyunsdkslb.request.v20140515.DescribeLoadBalancersRequest as DescribeSLB
-import aliyunsdkdds.request.v20151201.DescribeDBInstancesRequest as Mongodb
 from aliyunsdkcore.request import CommonRequest
 
+from .ratelimiter import RateLimiter
 from .utils import try_or_else, requestHistogram
 
 ecsInfoHistogram = requestHistogram.labels('ecs_info', False)
@@ -20,7 +22,18 @@ mongodbInfoHistogram = requestHistogram.labels('mongodb_info', False)
 elasticsearchInfoHistogram = requestHistogram.labels('elasticsearch_info', False)
 logstashInfoHistogram = requestHistogram.labels('logstash_info', False)
 
-cache = TTLCache(maxsize=1000, ttl=3600)
+infoCacheAge = Gauge('cloudmonitor_info_cache_age_seconds', 'Age of the cached resource information',
+                     ['region', 'resource', 'account'])
+infoRefreshDuration = Gauge('cloudmonitor_info_refresh_duration_seconds',
+                            'Duration of the last resource information refresh', ['region', 'resource', 'account'])
+
+# default refresher, AliyunCollector gives the providers of every account one of their own
+refresher = ThreadPoolExecutor(max_workers=4, thread_name_prefix='info-refresh')
+versions = itertools.count(1)
+
+def page_signature(page: list) -> str:
+    return hashlib.sha1(json.dumps(page, sort_keys=True).encode('utf-8')).hexdigest()
+
 
 class OpenAPIAddPageRequest(CommonRequest):
     def __init__(self, domain=None, version=None, action_name=None, uri_pattern=None, product=None,
@@ -36,9 +49,16 @@ class OpenAPIAddPageRequest(CommonRequest):
 '''
 InfoProvider provides the information of cloud resources as metric.
 
-The result from alibaba cloud API will be cached for an hour. 
+The result from alibaba cloud API is cached per resource. Once it is older
+than `refresh_interval` seconds, the stale result keeps being served while a
+refresh runs in the background, only the very first request of a resource
+waits for the API.
+
+Refreshes run on `executor`, the module's `refresher` unless given.
 
-Different resources should implement its own 'xxx_info' function. 
+Different resources should implement its own 'xxx_info' function, which
+imports the SDK module of its product, so only configured products are
+loaded.
 
 Different resource has different information structure, and most of
 them are nested, for simplicity, we map the top-level attributes to the
@@ -47,20 +67,105 @@ attribute is not handled explicitly, it will be dropped.
 '''
 class InfoProvider():
 
-    def __init__(self, client: AcsClient, protocol_type = 'http'):
+    def __init__(self, client: AcsClient, protocol_type = 'http', limiter: RateLimiter = None,
+                 refresh_interval: float = 3600, retry_interval: float = 60,
+                 incremental: bool = False, full_sync_interval: float = 21600,
+                 executor: ThreadPoolExecutor = None, account: str = None):
         self.client = client
+        self.executor = executor or refresher
+        self.account = account or ''
+        self.limiter = limiter
         assert protocol_type in ['http', 'https'], 'protocol_type must be "http" or "https"'
         self.protocol_type = protocol_type
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.incremental = incremental
+        self.full_sync_interval = full_sync_interval
+        self._inventory = {}
         self.infos = set()
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._pending = {}
+        self._failed = {}
 
     def append_info(self, info_name):
         self.infos.add(info_name)
+        infoCacheAge.labels(self.client.get_region_id(), info_name, self.account).set_function(
+            lambda: self.age(info_name))
 
     def has(self, info_name):
         return info_name in self.infos
 
-    @cached(cache)
+    def age(self, resource: str) -> float:
+        entry = self._entries.get(resource, None)
+        return time.time() - entry[0] if entry else float('inf')
+
+    def refresh(self, resource: str):
+        '''
+        Start a background refresh of the resource unless one is running.
+        '''
+        with self._lock:
+            future = self._pending.get(resource, None)
+            if future is None:
+                future = self.executor.submit(self._refresh, resource)
+                self._pending[resource] = future
+            return future
+
+    def prefetch(self, resource: str):
+        '''
+        Start loading a resource which was never fetched, without waiting.
+        '''
+        if resource not in self._entries:
+            self.refresh(resource)
+
+    def _refresh(self, resource: str):
+        start = time.time()
+        try:
+            data = self.fetch_metrics(resource)
+            signature = data.get('signature', None)
+            entry = self._entries.get(resource, None)
+            if signature and entry is not None and entry[1].get('signature', None) == signature:
+                # nothing changed, keep the version so nothing is rebuilt downstream
+                data['version'] = entry[1]['version']
+            else:
+                data['version'] = next(versions)
+            self._entries[resource] = (time.time(), data)
+            return data
+        except Exception as e:
+            self._failed[resource] = time.time()
+            logging.error('Error refresh %s info of %s' % (resource, self.client.get_region_id()), exc_info=e)
+            raise
+        finally:
+            infoRefreshDuration.labels(self.client.get_region_id(), resource, self.account).set(time.time() - start)
+            with self._lock:
+                self._pending.pop(resource, None)
+
+    def entries(self) -> dict:
+        '''
+        {resource: (fetched time, data)} of the cached resources.
+        '''
+        return dict(self._entries)
+
+    def restore(self, resource: str, fetched: float, data: dict):
+        '''
+        Seed the cache with a result fetched at `fetched`, e.g. loaded from
+        disk. It is refreshed in the background once older than
+        `refresh_interval`.
+        '''
+        if resource in self._entries:
+            return
+        self._entries[resource] = (fetched, dict(data, version=next(versions)))
+
     def get_metrics(self, resource: str) -> dict:
+        entry = self._entries.get(resource, None)
+        if entry is None:
+            return self.refresh(resource).result()
+        if time.time() - entry[0] > self.refresh_interval and \
+                time.time() - self._failed.get(resource, 0) > self.retry_interval:
+            self.refresh(resource)
+        return entry[1]
+
+    def fetch_metrics(self, resource: str) -> dict:
         return {
             'ecs': lambda : self.ecs_info(),
             'rds': lambda : self.rds_info(),
@@ -73,33 +178,41 @@ class InfoProvider():
 
     @ecsInfoHistogram.time()
     def ecs_info(self) -> dict:
+        import aliyunsdkecs.request.v20140526.DescribeInstancesRequest as DescribeECS
         req = DescribeECS.DescribeInstancesRequest()
         nested_handler = {
             'InnerIpAddress': lambda obj : try_or_else(lambda : obj['IpAddress'][0], ''),
             'PublicIpAddress': lambda obj : try_or_else(lambda : obj['IpAddress'][0], ''),
             'VpcAttributes': lambda obj : try_or_else(lambda : obj['PrivateIpAddress']['IpAddress'][0], ''),
         }
-        return self.info_template(req, 'ecs', nested_handler=nested_handler)
+        return self.info_template(req, 'ecs', nested_handler=nested_handler, id_key='InstanceId')
 
     @rdsInfoHistogram.time()
     def rds_info(self) -> dict:
+        import aliyunsdkrds.request.v20140815.DescribeDBInstancesRequest as DescribeRDS
         req = DescribeRDS.DescribeDBInstancesRequest()
-        return self.info_template(req, 'rds', to_list=lambda data: data['Items']['DBInstance'])
+        return self.info_template(req, 'rds', to_list=lambda data: data['Items']['DBInstance'], id_key='DBInstanceId')
 
     @redisInfoHistogram.time()
     def redis_info(self) -> dict:
+        import aliyunsdkr_kvstore.request.v20150101.DescribeInstancesRequest as DescribeRedis
         req = DescribeRedis.DescribeInstancesRequest()
-        return self.info_template(req, 'redis', to_list=lambda data: data['Instances']['KVStoreInstance'])
+        return self.info_template(req, 'redis', to_list=lambda data: data['Instances']['KVStoreInstance'],
+                                  id_key='InstanceId')
 
     @slbInfoHistogram.time()
     def slb_info(self) -> dict:
+        import aliyunsdkslb.request.v20140515.DescribeLoadBalancersRequest as DescribeSLB
         req = DescribeSLB.DescribeLoadBalancersRequest()
-        return self.info_template(req, 'slb', to_list=lambda data: data['LoadBalancers']['LoadBalancer'])
+        return self.info_template(req, 'slb', to_list=lambda data: data['LoadBalancers']['LoadBalancer'],
+                                  id_key='LoadBalancerId')
 
     @mongodbInfoHistogram.time()
     def mongodb_info(self) -> dict:
+        import aliyunsdkdds.request.v20151201.DescribeDBInstancesRequest as Mongodb
         req = Mongodb.DescribeDBInstancesRequest()
-        return self.info_template(req, 'mongodb', to_list=lambda data: data['DBInstances']['DBInstance'])
+        return self.info_template(req, 'mongodb', to_list=lambda data: data['DBInstances']['DBInstance'],
+                                  id_key='DBInstanceId')
 
     @elasticsearchInfoHistogram.time()
     def elasticsearch_info(self) -> dict:
@@ -112,7 +225,7 @@ class InfoProvider():
         req.set_domain('elasticsearch.%s.aliyuncs.com' % self.client.get_region_id())
         body = '''{}'''
         req.set_content(body.encode('utf-8'))
-        return self.info_template(req, 'elasticsearch', to_list=lambda data: data['Result'])
+        return self.info_template(req, 'elasticsearch', to_list=lambda data: data['Result'], id_key='instanceId')
 
     @logstashInfoHistogram.time()
     def logstash_info(self) -> dict:
@@ -125,10 +238,19 @@ class InfoProvider():
         req.set_domain('elasticsearch.%s.aliyuncs.com' % self.client.get_region_id())
         body = '''{}'''
         req.set_content(body.encode('utf-8'))
-        return self.info_template(req, 'logstash', to_list=lambda data: data['Result'])
+        return self.info_template(req, 'logstash', to_list=lambda data: data['Result'], id_key='instanceId')
 
     '''
     Template method to retrieve resource information and transform to metric.
+
+    With `incremental` enabled and an `id_key` given, a sync first fetches
+    only the first page. When its signature and the total count are the same
+    as on the previous sync, the previous result is kept as is, keeping its
+    version so the collector doesn't rebuild its join indexes either.
+    Otherwise, and at least every `full_sync_interval` seconds, all pages are
+    walked, and only pages whose signature changed get their labels rebuilt.
+    A change which neither moves the first page nor the total (e.g. a status
+    change on a later page) is picked up by the next full sync.
     '''
     def info_template(self,
                       req,
@@ -137,7 +259,10 @@ class InfoProvider():
                       page_size=100,
                       page_num=1,
                       nested_handler=None,
-                      to_list=(lambda data: data['Instances']['Instance'])) -> dict:
+                      to_list=(lambda data: data['Instances']['Instance']),
+                      id_key=None) -> dict:
+        if self.incremental and id_key:
+            return self.sync_inventory(req, name, desc, page_size, page_num, nested_handler, to_list, id_key)
         infos = []
         label_keys = None
         for instance in self.pager_generator(req, page_size, page_num, to_list):
@@ -146,19 +271,62 @@ class InfoProvider():
             infos.append(dict(zip(label_keys, self.label_values(instance, label_keys, nested_handler))))
         return {'name': name, 'desc': desc, 'infos': infos, 'labels': label_keys}
 
+    def sync_inventory(self, req, name, desc, page_size, page_num, nested_handler, to_list, id_key) -> dict:
+        previous = self._inventory.get(name, None) or {'synced': 0, 'labels': None, 'pages': {}, 'probe': None}
+        full = time.time() - previous['synced'] > self.full_sync_interval
+        totals = []
+        page_iter = self.page_generator(req, page_size, page_num, to_list, totals)
+        first = next(page_iter)
+        probe = (page_signature(first), totals[0])
+        if not full and probe == previous['probe']:
+            return previous['result']
+        label_keys = self.label_keys(first[0], nested_handler) if first else None
+        cached = previous['pages'] if label_keys == previous['labels'] else {}
+        pages = {}
+        rows = {}
+        digest = hashlib.sha1()
+        for page in itertools.chain((first,), page_iter):
+            signature = page_signature(page)
+            digest.update(signature.encode('utf-8'))
+            page_rows = cached.get(signature, None)
+            if page_rows is None:
+                page_rows = [(instance.get(id_key, None),
+                              dict(zip(label_keys, self.label_values(instance, label_keys, nested_handler))))
+                             for instance in page]
+            pages[signature] = page_rows
+            # an instance shifted to the next page while paging is listed once
+            rows.update(page_rows)
+        result = {'name': name, 'desc': desc, 'infos': list(rows.values()), 'labels': label_keys,
+                  'signature': digest.hexdigest()}
+        self._inventory[name] = {'synced': time.time(), 'labels': label_keys, 'pages': pages, 'probe': probe,
+                                 'result': result}
+        return result
+
     def pager_generator(self, req, page_size, page_num, to_list):
+        for instances in self.page_generator(req, page_size, page_num, to_list):
+            yield from instances
+
+    def page_generator(self, req, page_size, page_num, to_list, totals: list = None):
+        '''
+        Yield the instances of every page. The total count reported by the
+        API (None if it has none) is appended to `totals` with every page.
+        '''
         req.set_PageSize(page_size)
         req.set_protocol_type(self.protocol_type)
         while True:
             req.set_PageNumber(page_num)
             try:
-                resp = self.client.do_action_with_exception(req)
+                if self.limiter is not None:
+                    resp = self.limiter.do_action(self.client, req)
+                else:
+                    resp = self.client.do_action_with_exception(req)
             except Exception as err:
                 raise err
             data = json.loads(resp)
             instances = to_list(data)
-            for instance in instances:
-                yield instance
+            if totals is not None:
+                totals.append(data.get('TotalCount', data.get('TotalRecordCount', None)))
+            yield instances
             if len(instances) < page_size:
                 break
             page_num += 1
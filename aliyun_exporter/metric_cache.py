@@ -0,0 +1,132 @@
+import math
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from prometheus_client import Counter, Gauge
+
+hitCounter = Counter('cloudmonitor_metric_cache_hits', 'Metric queries served from the cache')
+missCounter = Counter('cloudmonitor_metric_cache_misses', 'Metric queries sent to CloudMonitor')
+evictionCounter = Counter('cloudmonitor_metric_cache_evictions', 'Cache entries evicted to stay within budget')
+entriesGauge = Gauge('cloudmonitor_metric_cache_entries', 'Entries in the metric cache')
+bytesGauge = Gauge('cloudmonitor_metric_cache_bytes', 'Estimated size of the metric cache')
+oldestGauge = Gauge('cloudmonitor_metric_cache_oldest_seconds', 'Age of the oldest entry in the metric cache')
+
+
+def period_ttl(period: int, last_timestamp: float = None, now: float = None) -> float:
+    '''
+    Seconds a result stays fresh. The datapoint after `last_timestamp` is
+    complete one period later and shows up about one more period after that;
+    never longer than a period, never shorter than 5 seconds.
+    '''
+    if last_timestamp is None or math.isnan(last_timestamp):
+        return max(5, period - 10)
+    now = time.time() if now is None else now
+    return min(period, max(5, last_timestamp + 2 * period - now))
+
+
+'''
+MetricCache is the process-wide cache of metric query results.
+
+Every entry has its own expiry. The cache is bounded by `max_entries` and
+by the estimated `max_bytes` of its values (their `nbytes`), the least
+recently used entries are evicted first. Concurrent misses of a key share
+one load.
+'''
+class MetricCache():
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 256 << 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+        entriesGauge.set_function(lambda: len(self._entries))
+        bytesGauge.set_function(lambda: self.bytes)
+        oldestGauge.set_function(self.oldest)
+
+    def configure(self, max_entries: int = None, max_bytes: int = None):
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, load, ttl):
+        '''
+        The cached value of `key`, or `load()` cached for `ttl(value)` seconds.
+        '''
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                hitCounter.inc()
+                return entry[2]
+            future = self._loading.get(key, None)
+            leader = future is None
+            if leader:
+                future = self._loading[key] = Future()
+        if not leader:
+            hitCounter.inc()
+            return future.result()
+        missCounter.inc()
+        try:
+            value = load()
+            self.put(key, value, ttl(value))
+        except BaseException as e:
+            with self._lock:
+                self._loading.pop(key, None)
+            future.set_exception(e)
+            raise
+        future.set_result(value)
+        return value
+
+    def put(self, key, value, ttl: float):
+        size = getattr(value, 'nbytes', None)
+        if size is None:
+            size = sys.getsizeof(value)
+        with self._lock:
+            self._loading.pop(key, None)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            now = time.time()
+            self._entries[key] = (now + ttl, size, value, now)
+            self.bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+            _, (_, size, _, _) = self._entries.popitem(last=False)
+            self.bytes -= size
+            evictionCounter.inc()
+
+    def items(self):
+        '''
+        (key, expires, value) of every entry, least recently used first.
+        '''
+        with self._lock:
+            return [(key, expires, value) for key, (expires, _, value, _) in self._entries.items()]
+
+    def oldest(self) -> float:
+        with self._lock:
+            stored = min((entry[3] for entry in self._entries.values()), default=None)
+        return time.time() - stored if stored is not None else 0
+
+    def restore(self, key, value, expires: float):
+        self.put(key, value, expires - time.time())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
+metric_cache = MetricCache()
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from aliyunsdkcore.acs_exception.exceptions import ServerException
+from prometheus_client import Gauge
+
+suppressedGauge = Gauge('cloudmonitor_suppressed_metric',
+                        'Seconds a metric without data is skipped before it is probed again',
+                        ['namespace', 'metric', 'region', 'reason', 'account'])
+
+
+class MetricUnavailable(Exception):
+    '''
+    A metric query which can't return data until something changes on the
+    Aliyun side, `reason` is 'denied' or 'no_datapoints'.
+    '''
+
+    def __init__(self, reason: str, message: str = ''):
+        super().__init__(message or reason)
+        self.reason = reason
+
+
+def is_denied(err: Exception) -> bool:
+    if not isinstance(err, ServerException):
+        return False
+    code = str(err.get_error_code())
+    return err.get_http_status() == 403 or code.startswith('Forbidden') or code.startswith('InvalidAuthorization')
+
+
+'''
+NegativeCache remembers metrics which returned no data, keyed by
+(namespace, metric, region).
+
+After the n-th consecutive failure a metric is skipped for
+`backoff * 2 ** (n - 1)` seconds, at most `max_backoff`, then probed again.
+Any datapoint clears the entry. A `backoff` of 0 disables it.
+'''
+class NegativeCache():
+
+    def __init__(self, backoff: float = 60, max_backoff: float = 3600, account: str = None):
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.account = account or ''
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def suppressed(self, key) -> bool:
+        entry = self._entries.get(key, None)
+        return entry is not None and entry[1] > time.time()
+
+    def failed(self, key, reason: str):
+        if self.backoff <= 0:
+            return
+        with self._lock:
+            failures = self._entries.get(key, (0, 0, None))[0] + 1
+            delay = min(self.max_backoff, self.backoff * 2 ** (failures - 1))
+            old = self._entries.get(key, None)
+            self._entries[key] = (failures, time.time() + delay, reason)
+        if old is not None and old[2] != reason:
+            self._remove_gauge(key, old[2])
+        suppressedGauge.labels(*key, reason, self.account).set(delay)
+
+    def succeeded(self, key):
+        if key not in self._entries:
+            return
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._remove_gauge(key, entry[2])
+
+    def _remove_gauge(self, key, reason):
+        try:
+            suppressedGauge.remove(*key, reason, self.account)
+        except KeyError:
+            pass
+
+    def __len__(self):
+        return len(self._entries)
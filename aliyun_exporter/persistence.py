@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from prometheus_client import Gauge
+
+from .datapoints import Datapoints
+from .metric_cache import MetricCache, metric_cache
+
+snapshotAge = Gauge('cloudmonitor_disk_snapshot_age_seconds', 'Age of the last snapshot written to disk')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS info (
+    account TEXT, region TEXT, resource TEXT, fetched REAL, data TEXT,
+    PRIMARY KEY (account, region, resource)
+);
+CREATE TABLE IF NOT EXISTS metrics (key TEXT PRIMARY KEY, expires REAL, data BLOB);
+'''
+
+
+'''
+DiskSnapshot keeps the info inventory and the metric cache in a SQLite file,
+so a restarted exporter serves warm data instead of crawling every API.
+
+The snapshot is rewritten every `interval` seconds. On load, inventories
+are restored as fetched at their original time (stale ones are refreshed in
+the background), metric results expired less than `max_age` seconds ago are
+restored and kept for at least `grace` seconds.
+'''
+class DiskSnapshot():
+
+    def __init__(self, path: str, interval: float = 60, max_age: float = 600, grace: float = 30,
+                 cache: MetricCache = metric_cache):
+        self.path = path
+        self.interval = interval
+        self.max_age = max_age
+        self.grace = grace
+        self.cache = cache
+        self.saved = None
+        self._stopped = threading.Event()
+        self._thread = None
+        snapshotAge.set_function(lambda: time.time() - self.saved if self.saved else float('inf'))
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.executescript(SCHEMA)
+        return conn
+
+    def save(self, collectors):
+        now = time.time()
+        infos = []
+        for collector in collectors:
+            for region_id, provider in collector.info_providers.items():
+                for resource, (fetched, data) in provider.entries().items():
+                    infos.append((collector.credential['access_key_id'], region_id, resource, fetched,
+                                  json.dumps(data)))
+        metrics = [(json.dumps(key), expires, value.dumps())
+                   for key, expires, value in self.cache.items() if isinstance(value, Datapoints)]
+        tmp = self.path + '.tmp'
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        conn = sqlite3.connect(tmp)
+        try:
+            conn.executescript(SCHEMA)
+            with conn:
+                conn.executemany('INSERT INTO info VALUES (?, ?, ?, ?, ?)', infos)
+                conn.executemany('INSERT INTO metrics VALUES (?, ?, ?)', metrics)
+        finally:
+            conn.close()
+        os.replace(tmp, self.path)
+        self.saved = now
+
+    def load(self, collectors) -> bool:
+        '''
+        Restore the snapshot into the collectors and the metric cache, True
+        when anything was restored.
+        '''
+        if not os.path.exists(self.path):
+            return False
+        now = time.time()
+        restored = 0
+        conn = None
+        try:
+            conn = self.connect()
+            providers = {(c.credential['access_key_id'], region_id): provider
+                         for c in collectors for region_id, provider in c.info_providers.items()}
+            for account, region_id, resource, fetched, data in conn.execute('SELECT * FROM info'):
+                provider = providers.get((account, region_id), None)
+                if provider is None or not provider.has(resource):
+                    continue
+                provider.restore(resource, fetched, json.loads(data))
+                restored += 1
+            rows = conn.execute('SELECT key, expires, data FROM metrics WHERE expires > ?', (now - self.max_age,))
+            for key, expires, data in rows:
+                self.cache.restore(tuple(json.loads(key)), Datapoints.loads(data), max(expires, now + self.grace))
+                restored += 1
+        except sqlite3.DatabaseError as e:
+            logging.warning('Ignore unreadable snapshot %s: %s' % (self.path, e))
+            return False
+        finally:
+            if conn is not None:
+                conn.close()
+        logging.info('Restored %d entries from %s' % (restored, self.path))
+        return restored > 0
+
+    def start(self, collectors):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(collectors,), name='aliyun-exporter-snapshot',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self, collectors):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.save(collectors)
+            except Exception as e:
+                logging.error('Error writing snapshot %s' % self.path, exc_info=e)
@@ -0,0 +1,70 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+'''
+SamplingProfiler samples the stacks of every thread at a fixed interval.
+
+Samples are wall-clock, so threads waiting on the API or a lock show up as
+well as those burning CPU. The result is in the collapsed stack format
+(`thread;frame;frame count` per line), which flamegraph.pl and speedscope
+read directly.
+'''
+class SamplingProfiler():
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='aliyun-exporter-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return ''.join('%s %d\n' % (stack, count) for stack, count in self.samples.most_common())
+
+
+def profile(collector, seconds: float = None, interval: float = 0.005) -> str:
+    '''
+    Collapsed stacks of every thread during one collection cycle of every
+    account, or during `seconds` seconds when given (e.g. in background mode).
+    '''
+    with SamplingProfiler(interval) as profiler:
+        if seconds is not None:
+            time.sleep(min(seconds, 300))
+        else:
+            for account in collector.account_collectors():
+                for _ in account.collect_all():
+                    pass
+    return profiler.collapsed()
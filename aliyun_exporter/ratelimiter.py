@@ -0,0 +1,152 @@
+import logging
+import random
+import threading
+import time
+
+from aliyunsdkcore.acs_exception.exceptions import ServerException
+from prometheus_client import Counter, Gauge, Histogram
+
+tokensGauge = Gauge('cloudmonitor_ratelimit_tokens', 'Tokens available in the rate limit bucket', ['api', 'account'])
+rateGauge = Gauge('cloudmonitor_ratelimit_rate', 'Current allowed requests per second of the bucket',
+                  ['api', 'account'])
+throttledCounter = Counter('cloudmonitor_throttled', 'Requests rejected by Aliyun flow control', ['api', 'account'])
+waitHistogram = Histogram(
+    'cloudmonitor_ratelimit_wait_seconds', 'Time spent queueing in the rate limiter', ['api', 'account'],
+    buckets=(.005, .01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, float('inf'))
+)
+
+
+def is_throttling(err: Exception) -> bool:
+    if not isinstance(err, ServerException):
+        return False
+    return err.get_http_status() == 429 or str(err.get_error_code()).startswith('Throttling')
+
+
+def api_name(req) -> str:
+    '''
+    'Product.Action' of an RPC request, 'domain/uri' of a ROA style request.
+    '''
+    if req.get_action_name():
+        return '%s.%s' % (req.get_product(), req.get_action_name())
+    return '%s%s' % (req.get_domain() or req.get_product(), req.get_uri_pattern())
+
+
+'''
+TokenBucket is a thread-safe token bucket with AIMD rate adaptation.
+
+`acquire` reserves a token and sleeps until it is due, so waiting callers are
+served in arrival order. `throttled` halves the rate (not below `min_rate`),
+`succeeded` raises it additively at most once a second, up to `max_rate`.
+'''
+class TokenBucket():
+
+    def __init__(self, name: str, rate: float, burst: float = None, min_rate: float = None, account: str = None):
+        self.name = name
+        self.account = account or ''
+        self.max_rate = rate
+        self.min_rate = min_rate or rate / 20
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+        self._adjusted = self._updated
+        self._lock = threading.Lock()
+        rateGauge.labels(name, self.account).set(self.rate)
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            tokensGauge.labels(self.name, self.account).set(self.tokens)
+        if wait > 0:
+            time.sleep(wait)
+        waitHistogram.labels(self.name, self.account).observe(wait)
+        return wait
+
+    def throttled(self):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+            self._adjusted = now
+            rateGauge.labels(self.name, self.account).set(self.rate)
+        throttledCounter.labels(self.name, self.account).inc()
+
+    def succeeded(self):
+        if self.rate >= self.max_rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self._adjusted < 1:
+                return
+            self._refill(now)
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+            self._adjusted = now
+            rateGauge.labels(self.name, self.account).set(self.rate)
+
+
+'''
+RateLimiter keeps one TokenBucket per API and region, shared by every caller
+in the process, and retries throttled requests with jittered exponential
+backoff.
+
+`rate_limit` calls per `rate_period` is the default for every bucket,
+`overrides` maps 'Product.Action' to a different number of calls per period.
+The metrics of the buckets are labelled with `account`.
+'''
+class RateLimiter():
+
+    def __init__(self, rate_limit=10, rate_period=1, overrides=None, max_retries=3, backoff=0.5, max_backoff=10,
+                 account: str = None):
+        self.account = account
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+        self.overrides = overrides or {}
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, api: str, region_id: str = None) -> TokenBucket:
+        key = '%s@%s' % (api, region_id) if region_id else api
+        bucket = self._buckets.get(key, None)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key, None)
+                if bucket is None:
+                    calls = self.overrides.get(api, self.rate_limit)
+                    bucket = TokenBucket(key, calls / self.rate_period, burst=calls, account=self.account)
+                    self._buckets[key] = bucket
+        return bucket
+
+    def call(self, bucket: TokenBucket, func, *args, **kwargs):
+        retries = 0
+        while True:
+            bucket.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as err:
+                if not is_throttling(err) or retries >= self.max_retries:
+                    raise
+                bucket.throttled()
+                delay = min(self.max_backoff, self.backoff * 2 ** retries) * random.uniform(0.5, 1.5)
+                logging.warning('Request %s throttled, retry in %.2fs' % (bucket.name, delay))
+                time.sleep(delay)
+                retries += 1
+                continue
+            bucket.succeeded()
+            return result
+
+    def do_action(self, client, req):
+        '''
+        Limited replacement of client.do_action_with_exception(req).
+        '''
+        return self.call(self.bucket(api_name(req), client.get_region_id()), client.do_action_with_exception, req)
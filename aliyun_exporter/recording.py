@@ -0,0 +1,190 @@
+import gzip
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from aliyunsdkcore.acs_exception.exceptions import ServerException
+
+from .ratelimiter import api_name
+
+# never written to a recording, the SDK signs requests after they leave us,
+# these only show up when a caller sets them explicitly
+REDACTED = ('AccessKeyId', 'AccessKeySecret', 'SecurityToken', 'Signature', 'SignatureNonce', 'Timestamp',
+            'BearerToken')
+# left out of the request key, so requests for "the last minute" match on replay
+TIME_WINDOW = ('StartTime', 'EndTime')
+
+
+def _params(req) -> dict:
+    params = dict(req.get_query_params() or {})
+    params.update(req.get_body_params() or {})
+    return {str(k): str(v) for k, v in params.items() if k not in REDACTED}
+
+
+def request_key(req, region_id: str) -> str:
+    '''
+    Identity of a request, independent of credentials and signing.
+    '''
+    content = req.get_content()
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', 'replace')
+    params = sorted((k, v) for k, v in _params(req).items() if k not in TIME_WINDOW)
+    return json.dumps([api_name(req), region_id, params, content or None])
+
+
+'''
+Recorder appends request/response pairs to a gzipped JSON lines file.
+
+Every line has the request key, the response body or the error of the
+ServerException, the time the call took and its offset from the start of
+the recording. Headers and credentials are never written.
+'''
+class Recorder():
+
+    def __init__(self, path: str):
+        self.path = path
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+
+    def record(self, key: str, elapsed: float, body: bytes = None, error: ServerException = None):
+        entry = {'key': key, 'at': round(time.time() - self.started, 3), 'elapsed': round(elapsed, 4)}
+        if error is not None:
+            entry['error'] = {'code': error.get_error_code(), 'message': error.get_error_msg(),
+                              'status': error.get_http_status()}
+        else:
+            entry['body'] = body.decode('utf-8') if isinstance(body, bytes) else body
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+'''
+RecordingClient wraps an AcsClient (or AsyncAcsClient) and records every
+do_action_with_exception call. Everything else is delegated.
+'''
+class RecordingClient():
+
+    def __init__(self, client, recorder: Recorder):
+        self.client = client
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def do_action_with_exception(self, req):
+        key = request_key(req, self.client.get_region_id())
+        start = time.perf_counter()
+        try:
+            body = self.client.do_action_with_exception(req)
+        except ServerException as e:
+            self.recorder.record(key, time.perf_counter() - start, error=e)
+            raise
+        self.recorder.record(key, time.perf_counter() - start, body=body)
+        return body
+
+
+'''
+Recording holds the responses of a recording by request key. Responses of
+a key are served in recorded order, the last one repeats once the others
+are used up.
+
+A recording cut short (the exporter was killed before the recorder was
+closed) is loaded up to its last complete line.
+'''
+class Recording():
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    if not line.endswith('\n'):
+                        break
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry['key'], deque()).append(entry)
+            except EOFError:
+                logging.warning('Recording %s is truncated, replaying its first %d responses' % (path, len(self)))
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    def next(self, key: str):
+        with self._lock:
+            entries = self._entries.get(key, None)
+            if not entries:
+                return None
+            if len(entries) > 1:
+                return entries.popleft()
+            return entries[0]
+
+
+'''
+ReplayClient answers requests from a Recording without any network access,
+taking the recorded time divided by `speed` (0 replays instantly). A
+request which was never recorded fails with a 404 ServerException.
+'''
+class ReplayClient():
+
+    def __init__(self, recording: Recording, region_id: str, speed: float = 1.0):
+        self.recording = recording
+        self.region_id = region_id
+        self.speed = speed
+
+    def get_region_id(self):
+        return self.region_id
+
+    def do_action_with_exception(self, req):
+        key = request_key(req, self.region_id)
+        entry = self.recording.next(key)
+        if entry is None:
+            raise ServerException('Replay.NotRecorded', 'No recorded response for %s' % key, http_status=404)
+        if self.speed > 0:
+            time.sleep(entry['elapsed'] / self.speed)
+        if 'error' in entry:
+            error = entry['error']
+            raise ServerException(error['code'], error['message'], http_status=error['status'])
+        return entry['body'].encode('utf-8')
+
+
+_opened = {}
+_opened_lock = threading.Lock()
+
+
+def _shared(cls, path: str):
+    # one Recorder/Recording per file, shared by the collectors of all accounts
+    with _opened_lock:
+        instance = _opened.get((cls, path), None)
+        if instance is None:
+            instance = _opened[(cls, path)] = cls(path)
+        return instance
+
+
+def open_recorder(path: str) -> Recorder:
+    return _shared(Recorder, path)
+
+
+def close_recorders():
+    '''
+    Close every opened Recorder, writing the end of its gzip stream.
+    '''
+    with _opened_lock:
+        for (cls, _), instance in _opened.items():
+            if cls is Recorder:
+                instance.close()
+
+
+def open_recording(path: str) -> Recording:
+    return _shared(Recording, path)
@@ -0,0 +1,42 @@
+import math
+import zlib
+
+
+def stable_jitter(key, spread: float) -> float:
+    '''
+    Map a task key onto [0, spread) deterministically, so restarts and
+    replicas spread the same task to the same slot.
+    '''
+    if spread <= 0:
+        return 0.0
+    return zlib.crc32(repr(key).encode('utf-8')) / 2 ** 32 * spread
+
+
+'''
+PeriodScheduler computes when a task with a given period should run next.
+
+Runs are aligned to CloudMonitor's aggregation windows (multiples of the
+period since epoch), delayed by `offset` seconds to let the window be
+aggregated, and spread by a deterministic per-key jitter of up to `jitter`
+seconds so metrics of the same period don't hit the API as one burst.
+'''
+class PeriodScheduler():
+
+    def __init__(self, offset: float = 10, jitter: float = 20):
+        self.offset = offset
+        self.jitter = jitter
+
+    def slot(self, key, period: float) -> float:
+        spread = max(0, min(self.jitter, period - self.offset))
+        return (self.offset + stable_jitter(key, spread)) % period
+
+    def next_due(self, key, period: float, now: float) -> float:
+        slot = self.slot(key, period)
+        return (math.floor((now - slot) / period) + 1) * period + slot
+
+    def first_due(self, key, period: float, now: float) -> float:
+        '''
+        The first run only waits for the jitter, so a fresh process serves
+        data as soon as possible without starting every task at once.
+        '''
+        return now + stable_jitter(key, min(self.jitter, period))
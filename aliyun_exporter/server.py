@@ -0,0 +1,127 @@
+import sys
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from traceback import format_exc
+
+from prometheus_client import Gauge
+from prometheus_client.exposition import gzip_accepted
+
+from .exposition import ExpositionCache, render_metrics
+from .utils import queue_depth
+
+inFlightGauge = Gauge('cloudmonitor_http_requests_in_flight', 'HTTP requests being served', ['handler'])
+queuedGauge = Gauge('cloudmonitor_http_requests_queued', 'HTTP requests waiting for a worker thread', ['handler'])
+
+
+def _getListens(hosts, ports):
+    for h in hosts:
+        for p in ports:
+            yield (h, int(p))
+
+
+class LazyApplication():
+    '''
+    WSGI application created by `factory` on its first request, so the web UI
+    costs nothing until somebody opens it.
+    '''
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.app = None
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if self.app is None:
+            with self._lock:
+                if self.app is None:
+                    self.app = self.factory()
+        return self.app(environ, start_response)
+
+
+def createApplication(app, exposition: ExpositionCache, workers: int = 4, debug_profile: bool = False):
+    '''
+    Tornado application keeping the IOLoop free: /metrics is a native
+    handler rendering on its own executor, the Flask UI runs on another
+    bounded executor, so a slow UI page never delays a scrape. Without `app`
+    only /metrics is served. With `debug_profile`, /debug/profile samples
+    the stacks of every thread on an executor of its own.
+    '''
+    from tornado.ioloop import IOLoop
+    from tornado.web import Application, FallbackHandler, HTTPError, RequestHandler
+    from tornado.wsgi import WSGIContainer
+
+    metrics_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='metrics')
+    queuedGauge.labels('metrics').set_function(queue_depth(metrics_executor))
+
+    class MetricsHandler(RequestHandler):
+
+        async def get(self):
+            compress = gzip_accepted(self.request.headers.get('Accept-Encoding', ''))
+            with inFlightGauge.labels('metrics').track_inprogress():
+                headers, chunks = await IOLoop.current().run_in_executor(
+                    metrics_executor, render_metrics, exposition, compress)
+            for name, value in headers:
+                self.set_header(name, value)
+            for chunk in chunks:
+                self.write(chunk)
+
+    handlers = [(r'/metrics', MetricsHandler)]
+    if debug_profile:
+        from .profiler import profile
+        profile_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='profile')
+
+        class ProfileHandler(RequestHandler):
+
+            async def get(self):
+                try:
+                    seconds = self.get_argument('seconds', None)
+                    seconds = float(seconds) if seconds is not None else None
+                    interval = float(self.get_argument('interval', '0.005'))
+                except ValueError:
+                    raise HTTPError(400)
+                if not interval >= 0.001:
+                    raise HTTPError(400, 'interval must be at least 0.001 seconds')
+                body = await IOLoop.current().run_in_executor(
+                    profile_executor, profile, exposition.collector, seconds, interval)
+                self.set_header('Content-Type', 'text/plain')
+                self.write(body)
+
+        handlers.append((r'/debug/profile', ProfileHandler))
+    if app is not None:
+        ui_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ui')
+        queuedGauge.labels('ui').set_function(queue_depth(ui_executor))
+
+        def ui_app(environ, start_response):
+            with inFlightGauge.labels('ui').track_inprogress():
+                return app(environ, start_response)
+        handlers.append((r'.*', FallbackHandler, dict(fallback=WSGIContainer(ui_app, executor=ui_executor))))
+    return Application(handlers)
+
+
+def createHttpServer(hosts, ports, app, exposition: ExpositionCache, workers: int = 4, debug_profile: bool = False):
+    from tornado.httpserver import HTTPServer
+    from tornado.ioloop import IOLoop
+    from tornado.log import access_log, LogFormatter
+    access_handlers = logging.StreamHandler(sys.stdout)
+    access_handlers.setFormatter(LogFormatter())
+    access_log.addHandler(access_handlers)
+    access_log.setLevel(logging.INFO)
+    http_server = HTTPServer(createApplication(app, exposition, workers, debug_profile))
+    listens = list(_getListens(hosts, ports))
+    total_listen = len(listens)
+    logging.info("Started exporter")
+    for address, port in listens:
+        logging.info('Listen on %s:%s' % (address, port))
+        try:
+            http_server.listen(int(port), address=address)
+        except Exception as err:
+            total_listen -= 1
+            logging.warning('Listen on %s:%s Failed. %s' % (address, port, err))
+            logging.debug(format_exc())
+    if total_listen == 0:
+        raise EnvironmentError('Start HttpServer Failed! No Address can be listened!')
+    try:
+        IOLoop.instance().start()
+    except KeyboardInterrupt:
+        pass
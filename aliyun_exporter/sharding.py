@@ -0,0 +1,62 @@
+import bisect
+import hashlib
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+'''
+HashRing maps work units onto exporter replicas by consistent hashing.
+
+Every member is placed `vnodes` times on the ring and a key belongs to the
+first member point after its hash, so adding or removing a replica only moves
+the keys of that replica's points.
+'''
+class HashRing():
+
+    def __init__(self, members, vnodes: int = 128):
+        members = [str(m) for m in members]
+        if not members:
+            raise ValueError('HashRing needs at least one member')
+        points = sorted((_hash('%s#%d' % (m, i)), m) for m in members for i in range(vnodes))
+        self.members = members
+        self._hashes = [h for h, _ in points]
+        self._owners = [m for _, m in points]
+
+    def owner(self, key: str) -> str:
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[i]
+
+
+'''
+Shard is the share of the work owned by one replica: `member` on a ring of
+`members`.
+'''
+class Shard():
+
+    def __init__(self, members, member, vnodes: int = 128):
+        self.ring = HashRing(members, vnodes)
+        self.member = str(member)
+        if self.member not in self.ring.members:
+            raise ValueError('Shard member %s is not in %s' % (self.member, self.ring.members))
+
+    def owns(self, key: str) -> bool:
+        return self.ring.owner(key) == self.member
+
+    @classmethod
+    def from_options(cls, index=None, count=None, peers=None):
+        '''
+        Members are the `peers` names if given, otherwise '0'..'count-1'.
+        `index` is this replica's position in either list. No shard (None)
+        when neither is configured.
+        '''
+        if peers:
+            if index is None:
+                raise ValueError('shard_index is required with shard_peers')
+            return cls(peers, peers[int(index)])
+        if count is None or int(count) <= 1:
+            return None
+        if index is None or not 0 <= int(index) < int(count):
+            raise ValueError('shard_index must be in [0, %d)' % int(count))
+        return cls(range(int(count)), int(index))
@@ -0,0 +1,86 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from aliyunsdkcms.request.v20190101 import DescribeMetricLastRequest
+from aliyunsdkcore.acs_exception.exceptions import ServerException
+
+from .aio import AsyncAcsClient, EventLoopThread
+
+
+class FakeCMSHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+
+    def do_POST(self):
+        self.connections.add(self.client_address)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        query.update({k: v[0] for k, v in parse_qs(body).items()})
+        if 'Signature' not in query or query.get('AccessKeyId') != 'ak':
+            status, body = 400, {'Code': 'SignatureDoesNotMatch', 'Message': 'no signature:x'}
+        elif query['MetricName'] == 'Throttled':
+            status, body = 400, {'Code': 'Throttling.User', 'Message': 'Request was denied due to user flow control.'}
+        else:
+            status, body = 200, {'Datapoints': json.dumps([{'instanceId': 'i-1', 'Average': 1.0}])}
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_cms():
+    FakeCMSHandler.connections = set()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeCMSHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:%d' % server.server_address[1]
+    server.shutdown()
+
+
+def new_request(endpoint, metric):
+    req = DescribeMetricLastRequest.DescribeMetricLastRequest()
+    req.set_endpoint(endpoint)
+    req.set_Namespace('acs_ecs_dashboard')
+    req.set_MetricName(metric)
+    return req
+
+
+def test_async_client_reuses_connections(fake_cms):
+    loop = EventLoopThread(pool_size=2)
+    client = AsyncAcsClient(ak='ak', secret='secret', region_id='cn-hangzhou', loop=loop)
+    for _ in range(10):
+        data = json.loads(client.do_action_with_exception(new_request(fake_cms, 'CPUUtilization')))
+        assert json.loads(data['Datapoints'])[0]['instanceId'] == 'i-1'
+    assert len(FakeCMSHandler.connections) <= 2
+    loop.close()
+
+
+def test_async_client_raises_server_exception(fake_cms):
+    loop = EventLoopThread()
+    client = AsyncAcsClient(ak='ak', secret='secret', region_id='cn-hangzhou', loop=loop)
+    with pytest.raises(ServerException) as e:
+        client.do_action_with_exception(new_request(fake_cms, 'Throttled'))
+    assert e.value.get_error_code() == 'Throttling.User'
+    loop.close()
+
+
+def test_async_client_uses_http_proxy(fake_cms, monkeypatch):
+    for name in ('NO_PROXY', 'no_proxy', 'http_proxy'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('HTTP_PROXY', fake_cms)
+    loop = EventLoopThread()
+    client = AsyncAcsClient(ak='ak', secret='secret', region_id='cn-hangzhou', loop=loop)
+    data = json.loads(client.do_action_with_exception(new_request('metrics.example.invalid', 'CPUUtilization')))
+    assert json.loads(data['Datapoints'])[0]['instanceId'] == 'i-1'
+    loop.close()
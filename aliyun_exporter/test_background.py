@@ -0,0 +1,39 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .background import BackgroundEngine, SnapshotStore
+from .scheduler import PeriodScheduler
+
+
+class FakeCollector():
+
+    def __init__(self, tasks):
+        self.pool = ThreadPoolExecutor(max_workers=2)
+        self._tasks = tasks
+
+    def tasks(self):
+        return self._tasks
+
+
+def test_snapshot_store_replace():
+    store = SnapshotStore()
+    store.update('a', [1, 2])
+    store.update('b', [3])
+    store.update('a', [4])
+    assert sorted(store.families()) == [3, 4]
+    assert store.version == 3
+
+
+def test_background_engine_polls_tasks():
+    calls = []
+
+    def task():
+        calls.append(time.time())
+        return ['family']
+
+    engine = BackgroundEngine(FakeCollector([(('ns', 'metric'), 0.05, task)]), scheduler=PeriodScheduler(0, 0))
+    engine.start()
+    time.sleep(0.3)
+    engine.stop()
+    assert list(engine.store.families()) == ['family']
+    assert 2 <= len(calls) <= 8
@@ -0,0 +1,57 @@
+import json
+
+from .catalog import MetricCatalog
+
+
+class FakeMetaClient():
+
+    def __init__(self, projects=3, metrics=5):
+        self.projects = [{'Project': 'acs_%d' % i, 'Description': ''} for i in range(projects)]
+        self.metrics = [{'Metric': 'metric_%d' % i, 'Dimensions': 'userId,instanceId', 'Periods': '60,300'}
+                        for i in range(metrics)]
+        self.metrics[0]['Dimensions'] = 'userId,device'
+        self.requests = []
+
+    def do_action_with_exception(self, req):
+        params = req.get_query_params()
+        self.requests.append((req.get_action_name(), params.get('Project')))
+        items = self.projects if req.get_action_name() == 'QueryProjectMeta' else self.metrics
+        size, page = params['PageSize'], params['PageNumber']
+        return json.dumps({'Total': str(len(items)),
+                           'Resources': {'Resource': items[(page - 1) * size:page * size]}}).encode('utf-8')
+
+
+def test_catalog_crawls_every_page():
+    client = FakeMetaClient(projects=3, metrics=5)
+    catalog = MetricCatalog(client, page_size=2)
+    index = catalog.refresh().result()
+    assert [p['Project'] for p in index.projects] == ['acs_0', 'acs_1', 'acs_2']
+    assert len(index.metrics['acs_1']) == 5
+    assert len(client.requests) == 2 + 3 * 3
+    assert [m['Metric'] for _, m in index.find('acs_0', dimension='device')] == ['metric_0']
+    assert len(index.find(period='300')) == 15
+    assert [p for p, _ in index.find(metric='metric_3')] == ['acs_0', 'acs_1', 'acs_2']
+    catalog.index()
+    assert len(client.requests) == 11
+
+
+def test_catalog_publishes_projects_before_metrics():
+    import threading
+    client = FakeMetaClient(projects=3, metrics=5)
+    gate = threading.Event()
+    do_action = client.do_action_with_exception
+
+    def slow(req):
+        if req.get_action_name() == 'QueryMetricMeta' and req.get_query_params()['Project'] != 'acs_0':
+            gate.wait()
+        return do_action(req)
+    client.do_action_with_exception = slow
+    catalog = MetricCatalog(client)
+    index = catalog.index()
+    assert [p['Project'] for p in index.projects] == ['acs_0', 'acs_1', 'acs_2']
+    assert not index.complete
+    assert len(catalog.index('acs_0').find('acs_0')) == 5
+    gate.set()
+    assert len(catalog.index('acs_2').find('acs_2')) == 5
+    catalog.refresh().result()
+    assert catalog.index().complete
@@ -0,0 +1,378 @@
+import json
+
+from .collector import AliyunCollector, CollectorConfig
+from .metric_cache import metric_cache
+
+
+class FakeClient():
+    '''
+    Serve DescribeMetricLast pages of `size` points for `total` instances.
+    '''
+
+    def __init__(self, total=5, size=2):
+        self.total = total
+        self.size = size
+        self.requests = []
+
+    def get_region_id(self):
+        return 'cn-hangzhou'
+
+    def do_action_with_exception(self, req):
+        params = req.get_query_params()
+        self.requests.append(params)
+        start = int(params.get('NextToken') or 0)
+        end = min(start + self.size, self.total)
+        data = {'Datapoints': json.dumps([
+            {'instanceId': 'i-%d' % i, 'timestamp': 1600000000000, 'Average': float(i)}
+            for i in range(start, end)
+        ])}
+        if end < self.total:
+            data['NextToken'] = str(end)
+        return json.dumps(data).encode('utf-8')
+
+
+def new_collector(client, **kwargs):
+    config = CollectorConfig(
+        credential={'access_key_id': 'ak', 'access_key_secret': 'secret'},
+        metrics={'acs_ecs_dashboard': {'metrics': [{'name': 'CPUUtilization'}]}},
+        info_metrics={},
+        **kwargs)
+    collector = AliyunCollector(config)
+    collector.client = client
+    metric_cache.clear()
+    return collector
+
+
+def test_query_metric_follows_next_token():
+    client = FakeClient(total=5, size=2)
+    collector = new_collector(client, cache_metrics=False, page_length=2)
+    gauge, up = collector.metric_generator('acs_ecs_dashboard', {'name': 'CPUUtilization'})
+    assert sorted(s.labels['instanceId'] for s in gauge.samples) == ['i-%d' % i for i in range(5)]
+    assert up.samples[0].value == 1
+    assert [r.get('NextToken') for r in client.requests] == [None, '2', '4']
+    assert all(r['Length'] == 2 for r in client.requests)
+
+
+def test_error_mid_pagination_reports_down():
+    from aliyunsdkcore.acs_exception.exceptions import ServerException
+    client = FakeClient(total=6, size=2)
+    do_action = client.do_action_with_exception
+
+    def failing(req):
+        if req.get_query_params().get('NextToken') == '4':
+            raise ServerException('InternalError', 'page 3 failed', http_status=500)
+        return do_action(req)
+    client.do_action_with_exception = failing
+    collector = new_collector(client, cache_metrics=False, page_length=2)
+    gauge, up = collector.metric_generator('acs_ecs_dashboard', {'name': 'CPUUtilization'})
+    assert len(gauge.samples) == 4
+    assert up.samples[0].value == 0
+
+
+def test_query_metric_empty():
+    collector = new_collector(FakeClient(total=0), cache_metrics=True)
+    families = collector.metric_generator('acs_ecs_dashboard', {'name': 'CPUUtilization'})
+    assert len(families) == 1
+    assert families[0].name == 'aliyun_acs_ecs_dashboard_CPUUtilization_up'
+    assert families[0].samples[0].value == 0
+
+
+def test_metrics_sharing_a_request_are_batched():
+    client = FakeClient(total=3, size=10)
+    collector = new_collector(client, cache_metrics=False)
+    collector.metrics['acs_ecs_dashboard']['metrics'] = [
+        {'name': 'CPUUtilization'},
+        {'name': 'CPUUtilization', 'rename': 'CPUUtilization_avg', 'measure': 'Average'},
+        {'name': 'CPUUtilization', 'period': 300},
+    ]
+    tasks = [t for t in collector.tasks() if t[0] != ('info',)]
+    assert len(tasks) == 2
+    families = [f for _, _, func in tasks for f in func()]
+    assert len(client.requests) == 2
+    names = sorted(f.name for f in families if not f.name.endswith('_up'))
+    assert names == ['aliyun_acs_ecs_dashboard_CPUUtilization', 'aliyun_acs_ecs_dashboard_CPUUtilization',
+                     'aliyun_acs_ecs_dashboard_CPUUtilization_avg']
+
+
+class FakeInfoProvider():
+
+    def __init__(self, instances):
+        self.data = {'name': 'ecs', 'desc': '', 'labels': ['InstanceId', 'InstanceName'], 'version': 1,
+                     'infos': instances}
+        self.infos = {'ecs'}
+
+    def has(self, resource):
+        return resource in self.infos
+
+    def prefetch(self, resource):
+        pass
+
+    def get_metrics(self, resource):
+        return self.data
+
+
+def test_extra_labels_follow_inventory():
+    collector = new_collector(FakeClient(total=3), cache_metrics=False)
+    collector.info_metrics = {'ecs': {}}
+    provider = FakeInfoProvider([{'InstanceId': 'i-0', 'InstanceName': 'web-0'}])
+    collector.info_providers = {'cn-hangzhou': provider}
+    collector.metrics['acs_ecs_dashboard']['extra_labels'] = {
+        'fromInfo': 'ecs', 'keys': {'instanceId': 'InstanceId'}, 'labels': [{'InstanceName': 'name'}],
+    }
+
+    def names():
+        families = list(collector.collect())
+        gauge = [f for f in families if f.name == 'aliyun_acs_ecs_dashboard_CPUUtilization'][0]
+        return {s.labels['instanceId']: s.labels['name'] for s in gauge.samples}
+
+    assert names() == {'i-0': 'web-0', 'i-1': '', 'i-2': ''}
+    provider.data = dict(provider.data, version=2, infos=[
+        {'InstanceId': 'i-0', 'InstanceName': 'web-0'}, {'InstanceId': 'i-1', 'InstanceName': 'web-1'}])
+    assert names() == {'i-0': 'web-0', 'i-1': 'web-1', 'i-2': ''}
+
+
+def test_concurrent_scrapes_share_one_collection():
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    client = FakeClient(total=3, size=10)
+    gate = threading.Event()
+    do_action = client.do_action_with_exception
+    client.do_action_with_exception = lambda req: gate.wait() and do_action(req)
+    collector = new_collector(client, cache_metrics=False)
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        scrapes = [pool.submit(lambda: list(collector.collect())) for _ in range(3)]
+        time.sleep(0.1)
+        gate.set()
+        results = [len(f.result()) for f in scrapes]
+    assert results == [2, 2, 2]
+    assert len(client.requests) == 1
+    assert collector.snapshot()[0] == 2
+
+
+class FakeRDSClient(FakeClient):
+
+    def do_action_with_exception(self, req):
+        params = req.get_query_params()
+        self.requests.append(params)
+        return json.dumps({'PerformanceKeys': {'PerformanceKey': [
+            {'Key': key, 'ValueFormat': 'recv_k&sent_k', 'Values': {'PerformanceValue': [{'Value': '1&2'}]}}
+            for key in params['Key'].split(',')
+        ]}}).encode('utf-8')
+
+
+def test_rds_performance_collects_every_region():
+    collector = new_collector(FakeClient())
+    collector.metrics = {'rds_performance': [{'name': 'MySQL_%d' % i} for i in range(12)]}
+    from .collector import RDSPerformanceCollector
+    rds = RDSPerformanceCollector(collector)
+    client = FakeRDSClient()
+    providers = {}
+    for region, ids in (('cn-a', ['rm-1', 'rm-2']), ('cn-b', ['rm-3'])):
+        provider = FakeInfoProvider([{'DBInstanceId': id} for id in ids])
+        provider.infos = {'rds'}
+        provider.client = client
+        providers[region] = provider
+    collector.info_providers = providers
+
+    families = {f.name: f for f in rds.collect()}
+    assert len(families) == 24
+    gauge = families['aliyun_rds_performance_MySQL_0_recv_k']
+    assert sorted((s.labels['instanceId'], s.value) for s in gauge.samples) == [
+        ('rm-1', 1.0), ('rm-2', 1.0), ('rm-3', 1.0)]
+    assert len(client.requests) == 6
+    list(rds.collect())
+    assert len(client.requests) == 6
+
+
+def test_namespace_region_ids():
+    collector = new_collector(FakeClient(total=1), cache_metrics=False)
+    collector.metrics['acs_ecs_dashboard']['region_ids'] = ['cn-a', 'cn-b']
+    collector.clients.update({'cn-a': FakeClient(total=2), 'cn-b': FakeClient(total=3)})
+    families = {f.name: f for f in collector.collect()}
+    gauge = families['aliyun_acs_ecs_dashboard_CPUUtilization']
+    assert sorted((s.labels['region'], s.labels['instanceId']) for s in gauge.samples) == [
+        ('cn-a', 'i-0'), ('cn-a', 'i-1'), ('cn-b', 'i-0'), ('cn-b', 'i-1'), ('cn-b', 'i-2')]
+    up = families['aliyun_acs_ecs_dashboard_CPUUtilization_up']
+    assert sorted(s.labels['region'] for s in up.samples) == ['cn-a', 'cn-b']
+    assert collector.client.requests == []
+
+
+def test_accounts_are_collected_separately():
+    from .collector import MultiAccountCollector
+    config = CollectorConfig(accounts=[
+        {'name': 'prod', 'credential': {'access_key_id': 'ak1', 'access_key_secret': 's1'},
+         'metrics': {'acs_ecs_dashboard': {'metrics': [{'name': 'CPUUtilization'}]}}},
+        {'name': 'test', 'credential': {'access_key_id': 'ak2', 'access_key_secret': 's2'},
+         'metrics': {'acs_ecs_dashboard': {'metrics': [{'name': 'CPUUtilization'}]}}, 'cache_metrics': False},
+    ])
+    assert config.credential['access_key_id'] == 'ak1'
+    multi = MultiAccountCollector(config)
+    clients = {}
+    for (name, collector), total in zip(multi.collectors, (1, 2)):
+        clients[name] = collector.client = FakeClient(total=total)
+    assert [c.cache_metrics for _, c in multi.collectors] == [True, False]
+    families = {f.name: f for f in multi.collect()}
+    gauge = families['aliyun_acs_ecs_dashboard_CPUUtilization']
+    assert sorted((s.labels['account'], s.labels['instanceId']) for s in gauge.samples) == [
+        ('prod', 'i-0'), ('test', 'i-0'), ('test', 'i-1')]
+    assert len(clients['prod'].requests) == 1 and len(clients['test'].requests) == 1
+
+
+def test_failing_account_does_not_break_others():
+    from aliyunsdkcore.acs_exception.exceptions import ServerException
+    from .collector import MultiAccountCollector
+
+    class DeniedClient(FakeClient):
+        def do_action_with_exception(self, req):
+            raise ServerException('Forbidden.RAM', 'denied', http_status=403)
+
+    config = CollectorConfig(accounts=[
+        {'name': name, 'credential': {'access_key_id': name, 'access_key_secret': 's'},
+         'metrics': {'acs_ecs_dashboard': {'metrics': [{'name': 'CPUUtilization'}]}}, 'info_metrics': {'ecs': {}},
+         'cache_metrics': False}
+        for name in ('prod', 'test')
+    ])
+    multi = MultiAccountCollector(config)
+    (_, prod), (_, test) = multi.collectors
+    prod.client = FakeClient(total=1)
+    prod.info_providers['cn-hangzhou'].client = FakeClient()
+    prod.info_providers['cn-hangzhou'].infos = set()
+    test.client = FakeClient(total=2)
+    test.info_providers['cn-hangzhou'].client = DeniedClient()
+    families = {f.name: f for f in multi.collect()}
+    gauge = families['aliyun_acs_ecs_dashboard_CPUUtilization']
+    assert sorted((s.labels['account'], s.labels['instanceId']) for s in gauge.samples) == [
+        ('prod', 'i-0'), ('test', 'i-0'), ('test', 'i-1')]
+
+    def broken():
+        raise ServerException('InternalError', 'down', http_status=500)
+    test.snapshot = broken
+    families = {f.name: f for f in multi.collect()}
+    up = {s.labels['account']: s.value for s in families['aliyun_account_up'].samples}
+    assert up == {'prod': 1, 'test': 0}
+    gauge = families['aliyun_acs_ecs_dashboard_CPUUtilization']
+    assert len(gauge.samples) == 3
+
+
+def test_account_options_are_checked():
+    import pytest
+    base = {'metrics': {'acs_ecs_dashboard': {'metrics': [{'name': 'CPUUtilization'}]}}}
+    config = CollectorConfig(credential={'access_key_id': 'ak', 'access_key_secret': 's'},
+                             accounts=[dict(base, name='prod')])
+    with pytest.raises(Exception, match='Credential of account prod'):
+        list(config.account_configs())
+    config = CollectorConfig(accounts=[dict(base, name='prod', cache_max_entries=10,
+                                            credential={'access_key_id': 'ak', 'access_key_secret': 's'})])
+    with pytest.raises(Exception, match='top level'):
+        list(config.account_configs())
+
+
+def test_account_telemetry_is_isolated():
+    from prometheus_client import REGISTRY
+    from .collector import MultiAccountCollector
+    config = CollectorConfig(accounts=[
+        {'name': name, 'credential': {'access_key_id': name, 'access_key_secret': 's'},
+         'metrics': {'acs_ecs_dashboard': {'metrics': [{'name': 'CPUUtilization'}]}}, 'info_metrics': {'ecs': {}},
+         'cache_metrics': False, 'rate_limit': limit}
+        for name, limit in (('prod', 10), ('test', 4))
+    ])
+    multi = MultiAccountCollector(config)
+    for _, collector in multi.collectors:
+        collector.client = FakeClient(total=1)
+        collector.info_providers = {}
+    list(multi.collect())
+    for name, limit in (('prod', 10), ('test', 4)):
+        labels = {'api': 'Cms.DescribeMetricLast@cn-hangzhou', 'account': name}
+        assert REGISTRY.get_sample_value('cloudmonitor_ratelimit_rate', labels) == limit
+        assert REGISTRY.get_sample_value('cloudmonitor_info_cache_age_seconds',
+                                         {'region': 'cn-hangzhou', 'resource': 'ecs', 'account': name}) is not None
+    prod, test = [collector for _, collector in multi.collectors]
+    assert prod.refresher is not test.refresher
+
+
+def test_shard_options_win_over_environment(monkeypatch):
+    monkeypatch.setenv('SHARD_INDEX', '2')
+    monkeypatch.setenv('SHARD_COUNT', '3')
+    config = CollectorConfig(credential={'access_key_id': 'ak', 'access_key_secret': 'secret'})
+    assert (config.shard_index, config.shard_count) == (2, 3)
+    config = CollectorConfig(credential={'access_key_id': 'ak', 'access_key_secret': 'secret'}, shard_index=0)
+    assert (config.shard_index, config.shard_count) == (0, 3)
+    assert config.shard.member == '0'
+
+
+def test_shards_split_the_metrics():
+    names = ['Metric_%d' % i for i in range(20)]
+    owned = []
+    for index in range(3):
+        collector = new_collector(FakeClient(total=1), cache_metrics=False, shard_index=index, shard_count=3)
+        collector.metrics['acs_ecs_dashboard']['metrics'] = [{'name': n} for n in names]
+        owned.append([key[2] for key, _, _ in collector.tasks() if key != ('info',)])
+    assert sorted(n for names in owned for n in names) == sorted(names)
+    assert all(names for names in owned)
+
+
+def test_cached_metrics_expire_by_period():
+    client = FakeClient(total=1)
+    collector = new_collector(client, cache_metrics=True)
+    collector.metrics['acs_ecs_dashboard']['metrics'] = [
+        {'name': 'CPUUtilization'}, {'name': 'CPUUtilization', 'period': 300}]
+    for _ in range(2):
+        list(collector.collect_all())
+    assert len(client.requests) == 2
+    assert len(metric_cache) == 2
+
+
+def test_series_are_counted_per_namespace():
+    from prometheus_client import REGISTRY
+    collector = new_collector(FakeClient(total=4, size=10), cache_metrics=False)
+    collector.metrics['acs_ecs_dashboard']['metrics'] = [{'name': 'CPUUtilization'}, {'name': 'memory_usedutilization'}]
+    list(collector.collect_all())
+    assert REGISTRY.get_sample_value('cloudmonitor_series', {'namespace': 'acs_ecs_dashboard', 'account': ''}) == 10
+    assert REGISTRY.get_sample_value('cloudmonitor_stage_seconds_count',
+                                     {'stage': 'decode', 'namespace': 'acs_ecs_dashboard'}) >= 2
+
+
+def test_special_collectors_are_created():
+    config = CollectorConfig(credential={'access_key_id': 'ak', 'access_key_secret': 'secret'},
+                             metrics={'rds_performance': [{'name': 'MySQL_NetworkTraffic'}]})
+    collector = AliyunCollector(config)
+    assert list(collector.special_collectors) == ['rds_performance']
+
+
+def test_empty_metrics_are_suppressed():
+    from aliyunsdkcore.acs_exception.exceptions import ServerException
+    client = FakeClient(total=0)
+    collector = new_collector(client, cache_metrics=False)
+    collector.metrics['acs_ecs_dashboard']['metrics'].append({'name': 'Denied'})
+    do_action = client.do_action_with_exception
+
+    def denying(req):
+        if req.get_query_params()['MetricName'] == 'Denied':
+            client.requests.append(req.get_query_params())
+            raise ServerException('Forbidden', 'denied', http_status=403)
+        return do_action(req)
+    client.do_action_with_exception = denying
+    for _ in range(3):
+        list(collector.collect_all())
+    assert len(client.requests) == 2
+    assert collector.negative_cache._entries[('acs_ecs_dashboard', 'Denied', 'cn-hangzhou')][2] == 'denied'
+    collector.negative_cache._entries.clear()
+    client.total = 1
+    families = {f.name: f for f in collector.collect_all()}
+    assert families['aliyun_acs_ecs_dashboard_CPUUtilization_up'].samples[0].value == 1
+    assert len(collector.negative_cache) == 1
+
+
+def test_info_task_runs_on_a_single_worker_pool():
+    from .test_info_provider import FakeClient as InfoClient
+    config = CollectorConfig(credential={'access_key_id': 'ak', 'access_key_secret': 'secret'},
+                             info_metrics={'ecs': {'region_ids': ['cn-hangzhou', 'cn-beijing']}},
+                             pool_size=1, background=True)
+    collector = AliyunCollector(config)
+    for provider in collector.info_providers.values():
+        provider.client = InfoClient([{'InstanceId': 'i-1'}])
+    task = dict((key, func) for key, _, func in collector.tasks())[('info',)]
+    families = collector.pool.submit(task).result(timeout=5)
+    assert [len(f.samples) for f in families] == [2]
@@ -0,0 +1,28 @@
+import math
+
+import pytest
+
+from .datapoints import Datapoints
+
+
+def test_datapoints_columns():
+    points = Datapoints().extend([
+        {'instanceId': 'i-0', 'userId': '1', 'timestamp': 1600000000000, 'Average': 1, 'Maximum': 2},
+        {'instanceId': 'i-1', 'userId': '1', 'timestamp': 1600000000000, 'Average': 3},
+    ])
+    points.extend([{'instanceId': 'i-2', 'Minimum': 0}])
+    assert points.label_keys == ('instanceId',)
+    assert points.labels == [('i-0',), ('i-1',), ('i-2',)]
+    assert list(points.column('Average'))[:2] == [1.0, 3.0]
+    assert math.isnan(points.column('Maximum')[1])
+    assert list(points.column('Minimum'))[2] == 0
+    assert math.isnan(points.column('Minimum')[0])
+    assert points.timestamp(0) == 1600000000 and points.timestamp(2) is None
+    with pytest.raises(KeyError):
+        points.column('Sum')
+
+
+def test_datapoints_share_label_strings():
+    a = Datapoints().extend([{'instanceId': ''.join(['i-', '0']), 'Average': 1}])
+    b = Datapoints().extend([{'instanceId': ''.join(['i-', '0']), 'Average': 2}])
+    assert a.labels[0][0] is b.labels[0][0]
@@ -0,0 +1,42 @@
+import gzip
+
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily
+
+from .exposition import ExpositionCache, render_metrics
+
+
+class FakeCollector():
+
+    def __init__(self):
+        self.calls = 0
+        self.current = 1
+
+    def snapshot(self):
+        return self.current, self.collect()
+
+    def collect(self):
+        self.calls += 1
+        yield GaugeMetricFamily('aliyun_test', '', value=self.calls)
+
+
+def test_render_only_on_version_change():
+    collector = FakeCollector()
+    cache = ExpositionCache(collector)
+    assert b'aliyun_test 1.0' in cache.render()
+    assert gzip.decompress(cache.render(compress=True)) == cache.render()
+    assert collector.calls == 1
+    collector.current = 2
+    assert b'aliyun_test 2.0' in cache.render()
+    collector.current = None
+    assert b'aliyun_test 3.0' in cache.render()
+    assert b'aliyun_test 4.0' in cache.render()
+
+
+def test_render_metrics_gzip():
+    headers, chunks = render_metrics(ExpositionCache(FakeCollector()), True, registry=CollectorRegistry())
+    headers = dict(headers)
+    body = b''.join(chunks)
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Content-Length'] == str(len(body))
+    assert b'aliyun_test 1.0' in gzip.decompress(body)
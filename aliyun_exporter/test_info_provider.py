@@ -0,0 +1,115 @@
+import json
+import threading
+import time
+
+from .info_provider import InfoProvider
+
+
+class FakeClient():
+
+    def __init__(self, instances):
+        self.instances = instances
+        self.calls = 0
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def get_region_id(self):
+        return 'cn-test'
+
+    def do_action_with_exception(self, req):
+        self.gate.wait()
+        self.calls += 1
+        return json.dumps({'Instances': {'Instance': list(self.instances)}}).encode('utf-8')
+
+
+def test_get_metrics_serves_stale_while_refreshing():
+    client = FakeClient([{'InstanceId': 'i-1'}])
+    provider = InfoProvider(client, refresh_interval=0.05)
+    provider.append_info('ecs')
+    assert provider.get_metrics('ecs')['infos'] == [{'InstanceId': 'i-1'}]
+    assert client.calls == 1
+
+    time.sleep(0.1)
+    client.gate.clear()
+    client.instances.append({'InstanceId': 'i-2'})
+    started = time.time()
+    assert provider.get_metrics('ecs')['infos'] == [{'InstanceId': 'i-1'}]
+    assert time.time() - started < 0.05
+    client.gate.set()
+    provider.refresh('ecs').result()
+    assert len(provider.get_metrics('ecs')['infos']) == 2
+    assert provider.age('ecs') < 1
+
+
+class PagedClient(FakeClient):
+
+    def do_action_with_exception(self, req):
+        self.calls += 1
+        size = int(req.get_query_params()['PageSize'])
+        page = int(req.get_query_params()['PageNumber'])
+        instances = self.instances[(page - 1) * size:page * size]
+        return json.dumps({'Instances': {'Instance': instances}, 'TotalCount': len(self.instances)}).encode('utf-8')
+
+
+def counting(provider):
+    rebuilt = []
+    label_values = provider.label_values
+
+    def wrapper(instance, *args):
+        rebuilt.append(instance['InstanceId'])
+        return label_values(instance, *args)
+    provider.label_values = wrapper
+    return rebuilt
+
+
+def test_incremental_sync_probes_the_first_page():
+    client = PagedClient([{'InstanceId': 'i-%03d' % i, 'Status': 'Running'} for i in range(250)])
+    provider = InfoProvider(client, incremental=True)
+    rebuilt = counting(provider)
+    first = provider.refresh('ecs').result()
+    assert len(first['infos']) == 250
+    assert len(rebuilt) == 250
+    assert client.calls == 3
+
+    rebuilt.clear()
+    assert provider.refresh('ecs').result()['version'] == first['version']
+    assert rebuilt == []
+    assert client.calls == 4
+
+    client.instances.insert(0, {'InstanceId': 'i-new', 'Status': 'Pending'})
+    client.instances[1] = {'InstanceId': 'i-000', 'Status': 'Stopped'}
+    infos = provider.ecs_info()['infos']
+    assert client.calls == 7
+    assert len(infos) == 251
+    assert {'InstanceId': 'i-000', 'Status': 'Stopped'} in infos
+
+
+def test_incremental_sync_sees_appended_instance():
+    client = PagedClient([{'InstanceId': 'i-%03d' % i, 'Status': 'Running'} for i in range(250)])
+    provider = InfoProvider(client, incremental=True)
+    rebuilt = counting(provider)
+    provider.ecs_info()
+    rebuilt.clear()
+    client.instances.append({'InstanceId': 'i-new', 'Status': 'Pending'})
+    infos = provider.ecs_info()['infos']
+    assert len(infos) == 251
+    assert {'InstanceId': 'i-new', 'Status': 'Pending'} in infos
+    assert len(rebuilt) == 51
+
+
+def test_full_sync_sees_change_on_later_page():
+    client = PagedClient([{'InstanceId': 'i-%03d' % i, 'Status': 'Running'} for i in range(350)])
+    provider = InfoProvider(client, incremental=True)
+    rebuilt = counting(provider)
+    first = provider.refresh('ecs').result()
+    rebuilt.clear()
+    client.instances[210] = {'InstanceId': 'i-210', 'Status': 'Stopped'}
+    # neither the first page nor the total moved, only the full sync sees it
+    assert provider.refresh('ecs').result()['version'] == first['version']
+    provider.full_sync_interval = 0
+    data = provider.refresh('ecs').result()
+    assert {'InstanceId': 'i-210', 'Status': 'Stopped'} in data['infos']
+    assert {'InstanceId': 'i-210', 'Status': 'Running'} not in data['infos']
+    assert len(data['infos']) == 350
+    assert rebuilt == ['i-%03d' % i for i in range(200, 300)]
+    assert data['version'] != first['version']
@@ -0,0 +1,58 @@
+import threading
+import time
+
+from .metric_cache import MetricCache, period_ttl
+
+
+class Value():
+
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+
+def test_period_ttl():
+    now = 1600000000
+    assert period_ttl(60) == 50
+    assert period_ttl(300, now - 400, now) == 200
+    assert period_ttl(60, now - 60, now) == 60
+    assert period_ttl(60, now - 3600, now) == 5
+
+
+def test_metric_cache_expiry_and_budget():
+    cache = MetricCache(max_entries=2, max_bytes=100)
+    loads = []
+
+    def load(key, nbytes=10):
+        return lambda: loads.append(key) or Value(nbytes)
+
+    cache.get('a', load('a'), lambda v: 60)
+    cache.get('a', load('a'), lambda v: 60)
+    assert loads == ['a']
+    cache.get('b', load('b'), lambda v: -1)
+    cache.get('b', load('b'), lambda v: 60)
+    assert loads == ['a', 'b', 'b']
+    cache.get('a', load('a'), lambda v: 60)
+    cache.get('c', load('c'), lambda v: 60)
+    assert sorted(cache._entries) == ['a', 'c']
+    cache.get('d', load('d', 95), lambda v: 60)
+    assert list(cache._entries) == ['d'] and cache.bytes == 95
+
+
+def test_metric_cache_single_load():
+    cache = MetricCache()
+    gate = threading.Event()
+    loads = []
+
+    def load():
+        loads.append(1)
+        gate.wait()
+        return Value(1)
+
+    threads = [threading.Thread(target=cache.get, args=('k', load, lambda v: 60)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert loads == [1]
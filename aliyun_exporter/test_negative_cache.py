@@ -0,0 +1,26 @@
+from aliyunsdkcore.acs_exception.exceptions import ServerException
+from prometheus_client import REGISTRY
+
+from .negative_cache import NegativeCache, is_denied
+
+
+def test_is_denied():
+    assert is_denied(ServerException('Forbidden.NotAuthorized', 'denied', http_status=400))
+    assert is_denied(ServerException('Unknown', 'denied', http_status=403))
+    assert not is_denied(ServerException('Throttling.User', 'slow down', http_status=400))
+
+
+def test_negative_cache_backs_off():
+    cache = NegativeCache(backoff=10, max_backoff=25, account='test')
+    key = ('acs_ecs_dashboard', 'CPUUtilization', 'cn-hangzhou')
+    labels = dict(zip(('namespace', 'metric', 'region'), key), reason='no_datapoints', account='test')
+    assert not cache.suppressed(key)
+    cache.failed(key, 'no_datapoints')
+    assert cache.suppressed(key)
+    assert REGISTRY.get_sample_value('cloudmonitor_suppressed_metric', labels) == 10
+    cache.failed(key, 'no_datapoints')
+    cache.failed(key, 'no_datapoints')
+    assert REGISTRY.get_sample_value('cloudmonitor_suppressed_metric', labels) == 25
+    cache.succeeded(key)
+    assert not cache.suppressed(key)
+    assert REGISTRY.get_sample_value('cloudmonitor_suppressed_metric', labels) is None
@@ -0,0 +1,38 @@
+import time
+
+from .info_provider import InfoProvider
+from .metric_cache import MetricCache
+from .persistence import DiskSnapshot
+from .test_collector import FakeClient, new_collector
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / 'snapshot.db')
+    old = new_collector(FakeClient(total=3))
+    provider = InfoProvider(FakeClient())
+    provider.append_info('ecs')
+    provider.restore('ecs', time.time(), {'name': 'ecs', 'labels': ['InstanceId'], 'infos': [{'InstanceId': 'i-0'}]})
+    old.info_providers = {'cn-hangzhou': provider}
+    cache = MetricCache()
+    points = old.query_metric('acs_ecs_dashboard', 'CPUUtilization', 60)
+    cache.put(('ak', 'cn-hangzhou', 'acs_ecs_dashboard', 'CPUUtilization', 60, 1000, None), points, 60)
+    DiskSnapshot(path, cache=cache).save([old])
+
+    new = new_collector(FakeClient())
+    provider = InfoProvider(FakeClient())
+    provider.append_info('ecs')
+    new.info_providers = {'cn-hangzhou': provider}
+    cache = MetricCache()
+    assert DiskSnapshot(path, cache=cache).load([new])
+    assert provider.get_metrics('ecs')['infos'] == [{'InstanceId': 'i-0'}]
+    (key, _, restored), = cache.items()
+    assert key == ('ak', 'cn-hangzhou', 'acs_ecs_dashboard', 'CPUUtilization', 60, 1000, None)
+    assert restored.labels == points.labels
+    assert list(restored.column('Average')) == [0.0, 1.0, 2.0]
+    assert list(restored.timestamps) == list(points.timestamps)
+
+
+def test_snapshot_ignores_broken_file(tmp_path):
+    path = tmp_path / 'snapshot.db'
+    path.write_bytes(b'not a database')
+    assert not DiskSnapshot(str(path), cache=MetricCache()).load([])
@@ -0,0 +1,22 @@
+import threading
+import time
+
+from .profiler import SamplingProfiler
+
+
+def busy(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+def test_sampling_profiler_collapses_stacks():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy, args=(stop,), name='busy-worker')
+    worker.start()
+    with SamplingProfiler(interval=0.001) as profiler:
+        time.sleep(0.05)
+    stop.set()
+    worker.join()
+    lines = profiler.collapsed().splitlines()
+    assert any(line.startswith('busy-worker;') and 'busy (test_profiler.py' in line for line in lines)
+    assert all(int(line.rsplit(' ', 1)[1]) > 0 for line in lines)
@@ -0,0 +1,60 @@
+import time
+
+import pytest
+from aliyunsdkcore.acs_exception.exceptions import ServerException
+
+from .ratelimiter import RateLimiter, TokenBucket, is_throttling
+
+
+def test_is_throttling():
+    assert is_throttling(ServerException('Throttling.User', 'denied', http_status=400))
+    assert is_throttling(ServerException('Unknown', 'denied', http_status=429))
+    assert not is_throttling(ServerException('Forbidden', 'denied', http_status=403))
+    assert not is_throttling(ValueError())
+
+
+def test_token_bucket_waits_when_empty():
+    bucket = TokenBucket('test', rate=100, burst=2)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() > 0
+
+
+def test_token_bucket_aimd():
+    bucket = TokenBucket('test_aimd', rate=10)
+    bucket.throttled()
+    assert bucket.rate == 5
+    bucket.succeeded()
+    assert bucket.rate == 5
+    bucket._adjusted -= 1
+    bucket.succeeded()
+    assert bucket.rate == 5.5
+
+
+def test_rate_limiter_retries_throttled():
+    limiter = RateLimiter(rate_limit=1000, max_retries=2, backoff=0.01)
+    calls = []
+
+    def func():
+        calls.append(time.time())
+        if len(calls) < 3:
+            raise ServerException('Throttling.User', 'denied', http_status=400)
+        return 'ok'
+
+    bucket = limiter.bucket('Cms.DescribeMetricLast', 'cn-hangzhou')
+    assert limiter.call(bucket, func) == 'ok'
+    assert len(calls) == 3
+    assert bucket.rate == 250
+
+    calls.clear()
+    limiter.max_retries = 1
+    with pytest.raises(ServerException):
+        limiter.call(bucket, func)
+
+
+def test_rate_limiter_buckets():
+    limiter = RateLimiter(rate_limit=10, rate_period=2, overrides={'Ecs.DescribeInstances': 4})
+    assert limiter.bucket('Cms.DescribeMetricLast', 'a') is limiter.bucket('Cms.DescribeMetricLast', 'a')
+    assert limiter.bucket('Cms.DescribeMetricLast', 'a') is not limiter.bucket('Cms.DescribeMetricLast', 'b')
+    assert limiter.bucket('Cms.DescribeMetricLast').rate == 5
+    assert limiter.bucket('Ecs.DescribeInstances').rate == 2
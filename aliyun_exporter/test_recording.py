@@ -0,0 +1,61 @@
+import gzip
+
+import pytest
+from aliyunsdkcore.acs_exception.exceptions import ServerException
+
+from .recording import Recorder, RecordingClient, Recording, ReplayClient, request_key
+from .test_collector import FakeClient, new_collector
+
+
+def test_record_and_replay(tmp_path):
+    path = str(tmp_path / 'traffic.jsonl.gz')
+    recorder = Recorder(path)
+    live = new_collector(RecordingClient(FakeClient(total=5, size=2), recorder), cache_metrics=False, page_length=2)
+    expected = sorted(s.labels['instanceId'] for s in live.metric_generator(
+        'acs_ecs_dashboard', {'name': 'CPUUtilization'})[0].samples)
+    recorder.close()
+    assert b'secret' not in gzip.open(path).read()
+
+    recording = Recording(path)
+    assert len(recording) == 3
+    replay = new_collector(ReplayClient(recording, 'cn-hangzhou', speed=0), cache_metrics=False, page_length=2)
+    gauge = replay.metric_generator('acs_ecs_dashboard', {'name': 'CPUUtilization'})[0]
+    assert sorted(s.labels['instanceId'] for s in gauge.samples) == expected
+
+
+def test_replay_unknown_request(tmp_path):
+    path = str(tmp_path / 'empty.jsonl.gz')
+    Recorder(path).close()
+    client = ReplayClient(Recording(path), 'cn-hangzhou', speed=0)
+    from aliyunsdkcms.request.v20190101 import DescribeMetricLastRequest
+    with pytest.raises(ServerException) as e:
+        client.do_action_with_exception(DescribeMetricLastRequest.DescribeMetricLastRequest())
+    assert e.value.get_http_status() == 404
+
+
+def test_truncated_recording_is_replayed(tmp_path):
+    path = str(tmp_path / 'traffic.jsonl.gz')
+    recorder = Recorder(path)
+    for i in range(3):
+        recorder.record('key-%d' % i, 0.01, body=b'{}')
+    # what is on disk when the process is killed: no gzip trailer yet
+    killed = str(tmp_path / 'killed.jsonl.gz')
+    with open(path, 'rb') as src, open(killed, 'wb') as dst:
+        dst.write(src.read())
+    recorder.close()
+    recording = Recording(killed)
+    assert len(recording) == 3
+    assert recording.next('key-2')['body'] == '{}'
+
+
+def test_time_window_is_not_part_of_the_key():
+    from aliyunsdkrds.request.v20140815.DescribeDBInstancePerformanceRequest import \
+        DescribeDBInstancePerformanceRequest
+    keys = set()
+    for minute in ('2020-01-01T00:00Z', '2020-01-01T00:01Z'):
+        req = DescribeDBInstancePerformanceRequest()
+        req.set_DBInstanceId('rm-1')
+        req.set_StartTime(minute)
+        req.set_EndTime(minute)
+        keys.add(request_key(req, 'cn-hangzhou'))
+    assert len(keys) == 1
@@ -0,0 +1,25 @@
+from .scheduler import PeriodScheduler, stable_jitter
+
+
+def test_stable_jitter():
+    assert stable_jitter(('ns', 'a'), 0) == 0
+    assert stable_jitter(('ns', 'a'), 20) == stable_jitter(('ns', 'a'), 20)
+    assert 0 <= stable_jitter(('ns', 'a'), 20) < 20
+    assert len({stable_jitter(('ns', str(i)), 20) for i in range(100)}) > 50
+
+
+def test_next_due_aligned_to_period():
+    scheduler = PeriodScheduler(offset=10, jitter=0)
+    assert scheduler.next_due('k', 60, 1200) == 1210
+    assert scheduler.next_due('k', 60, 1210) == 1270
+    assert scheduler.next_due('k', 300, 1215) == 1510
+
+
+def test_next_due_jitter_inside_period():
+    scheduler = PeriodScheduler(offset=10, jitter=20)
+    for i in range(50):
+        key = ('ns', str(i))
+        due = scheduler.next_due(key, 60, 1200)
+        assert 1200 < due <= 1260
+        assert 10 <= due % 60 < 30
+        assert scheduler.next_due(key, 60, due) == due + 60
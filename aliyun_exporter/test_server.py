@@ -0,0 +1,87 @@
+import gzip
+import time
+
+from flask import Flask
+from prometheus_client.core import GaugeMetricFamily
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from .exposition import ExpositionCache
+from .server import LazyApplication, createApplication
+
+
+class SlowCollector():
+
+    def snapshot(self):
+        return None, self.collect()
+
+    def collect(self):
+        time.sleep(0.5)
+        yield GaugeMetricFamily('aliyun_test', '', value=1)
+
+
+class ServerTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = Flask(__name__)
+        app.route('/')(lambda: 'index')
+        return createApplication(app, ExpositionCache(SlowCollector()), workers=2)
+
+    def test_metrics(self):
+        response = self.fetch('/metrics', headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+        assert response.code == 200
+        assert b'aliyun_test 1.0' in gzip.decompress(response.body)
+
+    @gen_test
+    async def test_ui_not_blocked_by_scrape(self):
+        scrape = self.http_client.fetch(self.get_url('/metrics'))
+        started = time.time()
+        response = await self.http_client.fetch(self.get_url('/'))
+        assert response.body == b'index'
+        assert time.time() - started < 0.4
+        assert (await scrape).code == 200
+
+
+class MetricsOnlyTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.created = []
+
+        def factory():
+            self.created.append(1)
+            app = Flask(__name__)
+            app.route('/')(lambda: 'index')
+            return app
+        self.ui = LazyApplication(factory)
+        return createApplication(self.ui, ExpositionCache(SlowCollector()), workers=2)
+
+    def test_ui_created_on_first_request(self):
+        assert self.fetch('/metrics').code == 200
+        assert self.created == []
+        assert self.fetch('/').body == b'index'
+        assert self.fetch('/').body == b'index'
+        assert self.created == [1]
+
+
+class NoUITest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return createApplication(None, ExpositionCache(SlowCollector()), workers=2)
+
+    def test_only_metrics(self):
+        assert self.fetch('/metrics').code == 200
+        assert self.fetch('/').code == 404
+        assert self.fetch('/debug/profile?seconds=0.05').code == 404
+
+
+class ProfileTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return createApplication(None, ExpositionCache(SlowCollector()), workers=2, debug_profile=True)
+
+    def test_profile_without_ui(self):
+        response = self.fetch('/debug/profile?seconds=0.05&interval=0.001')
+        assert response.code == 200
+        assert b'MainThread' in response.body
+        assert self.fetch('/debug/profile?seconds=soon').code == 400
+        assert self.fetch('/debug/profile?seconds=0.05&interval=0').code == 400
+        assert self.fetch('/debug/profile?seconds=0.05&interval=-1').code == 400
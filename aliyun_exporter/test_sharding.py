@@ -0,0 +1,24 @@
+import pytest
+
+from .sharding import HashRing, Shard
+
+
+def test_hash_ring_moves_few_keys():
+    keys = ['acs_ecs_dashboard/metric_%d/cn-hangzhou' % i for i in range(1000)]
+    before = HashRing(['0', '1', '2'])
+    after = HashRing(['0', '1', '2', '3'])
+    owners = {k: before.owner(k) for k in keys}
+    assert set(owners.values()) == {'0', '1', '2'}
+    moved = [k for k in keys if after.owner(k) != owners[k]]
+    assert all(after.owner(k) == '3' for k in moved)
+    assert 100 < len(moved) < 400
+
+
+def test_shard_from_options():
+    assert Shard.from_options() is None
+    assert Shard.from_options(0, 1) is None
+    shards = [Shard.from_options(i, 3) for i in range(3)]
+    assert [s.owns('some/key') for s in shards].count(True) == 1
+    assert Shard.from_options(1, peers=['a', 'b']).member == 'b'
+    with pytest.raises(ValueError):
+        Shard.from_options(3, 3)
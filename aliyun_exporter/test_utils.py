@@ -12,3 +12,17 @@ def test_format_period():
     assert format_period("3000") == "3000"
     assert format_period("5,10,25,50,100,300") == "5"
     assert format_period("300_00,500_00") == "300_00"
+
+
+def test_merge_families():
+    from prometheus_client.core import GaugeMetricFamily
+    from .utils import merge_families
+    a = GaugeMetricFamily('a', '', labels=['region'])
+    a.add_metric(['x'], 1)
+    b = GaugeMetricFamily('a', '', labels=['region'])
+    b.add_metric(['y'], 2)
+    c = GaugeMetricFamily('c', '', value=3)
+    merged = list(merge_families([a, c, b]))
+    assert [f.name for f in merged] == ['a', 'c']
+    assert [s.value for s in merged[0].samples] == [1, 2]
+    assert len(a.samples) == 1
@@ -1,7 +1,4 @@
-import sys
-import logging
-from traceback import format_exc
-from prometheus_client import Histogram, Metric
+from prometheus_client import Gauge, Histogram, Metric
 
 def format_metric(text: str):
     return text.replace('.', '_')
@@ -17,53 +14,83 @@ def try_or_else(op, default):
     except:
         return default
 
-def mapInfoByKeys(point_labels:list, info:Metric, ext_labels:list):
-    resp = {}
-    for sample in info.samples:
-        mapKey = ','.join(map(lambda x:sample.labels.get(x, ''), point_labels))
-        mapValue = []
+'''
+JoinIndex maps the dimension values of a datapoint to extra label values
+taken from an info metric.
+
+The index is keyed by the tuple of `info_keys` label values of every info
+sample, `ext_labels` lists the info labels to append, a dict item renames
+its info labels to its values. Missing entries resolve to empty labels.
+'''
+class JoinIndex():
+
+    def __init__(self, info: Metric, info_keys: list, ext_labels: list):
+        source_names = []
+        self.label_names = []
         for el in ext_labels:
             if isinstance(el, dict):
-                mapValue.extend(map(lambda x:sample.labels.get(x, ''), el.keys()))
+                source_names.extend(el.keys())
+                self.label_names.extend(el.values())
             else:
-                mapValue.append(sample.labels.get(el, ''))
-        resp[mapKey] = mapValue
-    return resp
+                source_names.append(el)
+                self.label_names.append(el)
+        self.missing = ('',) * len(source_names)
+        self._index = {}
+        for sample in info.samples:
+            labels = sample.labels
+            key = tuple(labels.get(k, '') for k in info_keys)
+            self._index[key] = tuple(labels.get(k, '') for k in source_names)
+
+    def __len__(self):
+        return len(self._index)
+
+    def lookup(self, key: tuple) -> tuple:
+        return self._index.get(key, self.missing)
+
+def merge_families(families):
+    '''
+    Merge families sharing a name (e.g. one per region) into one family, as
+    the exposition format allows every metric name only once. The input
+    families are left untouched.
+    '''
+    merged = {}
+    owned = set()
+    for family in families:
+        existing = merged.get(family.name, None)
+        if existing is None:
+            merged[family.name] = family
+            continue
+        if family.name not in owned:
+            copy = Metric(existing.name, existing.documentation, existing.type, existing.unit)
+            copy.samples = list(existing.samples)
+            merged[family.name] = existing = copy
+            owned.add(family.name)
+        existing.samples.extend(family.samples)
+    return merged.values()
+
+def add_label(families, name: str, value: str):
+    '''
+    Copies of the families with one more label on every sample.
+    '''
+    for family in families:
+        copy = Metric(family.name, family.documentation, family.type, family.unit)
+        copy.samples = [sample._replace(labels=dict(sample.labels, **{name: value})) for sample in family.samples]
+        yield copy
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, .75, 1, 2.5, 5, 10, 30, 60, 120, float('inf'))
 
 requestHistogram = Histogram(
     'cloudmonitor_request', 'CloudMonitor request latency', ['namespace', 'limiter'],
-    buckets=(.1, .25, .5, .75, 1, 2.5, float('inf'))
+    buckets=LATENCY_BUCKETS
+)
+# stages: wait (rate limiter and retries), request, decode, enrich, build, task, encode
+stageHistogram = Histogram(
+    'cloudmonitor_stage_seconds', 'Time spent in each stage of a collection', ['stage', 'namespace'],
+    buckets=LATENCY_BUCKETS
 )
+seriesGauge = Gauge('cloudmonitor_series', 'Series exported per namespace', ['namespace', 'account'])
+poolQueueGauge = Gauge('cloudmonitor_pool_queue_depth', 'Tasks waiting for a worker thread', ['pool', 'account'])
 
-def _getListens(hosts, ports):
-    for h in hosts:
-        for p in ports:
-            yield (h, int(p))
-
-def createHttpServer(hosts, ports, app):
-    from tornado.wsgi import WSGIContainer
-    from tornado.httpserver import HTTPServer
-    from tornado.ioloop import IOLoop
-    from tornado.log import access_log, LogFormatter
-    access_handlers = logging.StreamHandler(sys.stdout)
-    access_handlers.setFormatter(LogFormatter())
-    access_log.addHandler(access_handlers)
-    access_log.setLevel(logging.INFO)
-    http_server = HTTPServer(WSGIContainer(app))
-    listens = list(_getListens(hosts, ports))
-    total_listen = len(listens)
-    logging.info("Started exporter")
-    for address, port in listens:
-        logging.info('Listen on %s:%s' % (address, port))
-        try:
-            http_server.listen(int(port), address=address)
-        except Exception as err:
-            total_listen -= 1
-            logging.warning('Listen on %s:%s Failed. %s' % (address, port, err))
-            logging.debug(format_exc())
-    if total_listen == 0:
-        raise EnvironmentError('Start HttpServer Failed! No Address can be listened!')
-    try:
-        IOLoop.instance().start()
-    except KeyboardInterrupt:
-        pass
\ No newline at end of file
+
+def queue_depth(executor):
+    return lambda: executor._work_queue.qsize()
@@ -0,0 +1,183 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+'''
+FakeAliyun is a local stand-in for the CMS, ECS, RDS, Redis, SLB and
+Elasticsearch APIs used by AliyunCollector and InfoProvider.
+
+It is an HTTP proxy: point HTTP_PROXY at `proxy` and use protocol_type http,
+the SDK then sends every request here with the real host name, which picks
+the product. `instances` ECS instances are generated, `ratio` times as many
+of every other resource. Each response is delayed by `latency` seconds and
+answered with a Throttling.User error with probability `throttle`.
+
+A request for `/_calls` sent to the server itself, not through it as a
+proxy, returns the API call counts since the previous one and resets them.
+'''
+class FakeAliyun():
+
+    def __init__(self, instances: int = 1000, ratio: float = 0.1, latency: float = 0.0, throttle: float = 0.0,
+                 seed: int = 0):
+        self.latency = latency
+        self.throttle = throttle
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        others = max(1, int(instances * ratio))
+        self.fleets = {
+            'ecs': ['i-%08d' % i for i in range(instances)],
+            'rds': ['rm-%08d' % i for i in range(others)],
+            'redis': ['r-%08d' % i for i in range(others)],
+            'slb': ['lb-%08d' % i for i in range(others)],
+            'elasticsearch': ['es-%08d' % i for i in range(others)],
+        }
+        self.namespaces = {
+            'acs_ecs_dashboard': 'ecs',
+            'acs_rds_dashboard': 'rds',
+            'acs_kvstore': 'redis',
+            'acs_slb_dashboard': 'slb',
+            'acs_elasticsearch': 'elasticsearch',
+        }
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def proxy(self) -> str:
+        return 'http://127.0.0.1:%d' % self.server.server_port
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_calls(self) -> Counter:
+        with self._lock:
+            calls, self.calls = self.calls, Counter()
+        return calls
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path == '/_calls':
+                    return self.reply(200, fake.reset_calls())
+                url = urlsplit(self.path)
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    params.update(parse_qsl(self.rfile.read(length).decode('utf-8')))
+                host = (self.headers.get('Host') or url.netloc).split(':')[0]
+                self.reply(*fake.handle(host, url.path, params))
+
+            def reply(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_POST = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def handle(self, host: str, path: str, params: dict):
+        action = params.get('Action') or path
+        with self._lock:
+            self.calls[action] += 1
+            throttled = self.random.random() < self.throttle
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            return 400, {'Code': 'Throttling.User', 'Message': 'Request was denied due to user flow control.',
+                         'RequestId': 'fake'}
+        if action == 'DescribeMetricLast':
+            return 200, self.metric_last(params)
+        if host.startswith('elasticsearch.'):
+            return 200, self.es_instances(params)
+        product = host.split('.')[0].split('-')[0]
+        if product == 'r':
+            product = 'redis'
+        return 200, self.instances(product, params)
+
+    def page(self, items: list, number: int, size: int) -> list:
+        return items[(number - 1) * size:number * size]
+
+    def instances(self, product: str, params: dict) -> dict:
+        number, size = int(params.get('PageNumber', 1)), int(params.get('PageSize', 10))
+        if product == 'ecs':
+            items = [{'InstanceId': id, 'InstanceName': 'ecs-%s' % id, 'Status': 'Running',
+                      'InnerIpAddress': {'IpAddress': []}, 'PublicIpAddress': {'IpAddress': []},
+                      'VpcAttributes': {'PrivateIpAddress': {'IpAddress': ['10.0.0.1']}}}
+                     for id in self.page(self.fleets['ecs'], number, size)]
+            return {'Instances': {'Instance': items}, 'TotalCount': len(self.fleets['ecs'])}
+        if product == 'rds':
+            items = [{'DBInstanceId': id, 'DBInstanceDescription': 'rds-%s' % id, 'Engine': 'MySQL'}
+                     for id in self.page(self.fleets['rds'], number, size)]
+            return {'Items': {'DBInstance': items}, 'TotalRecordCount': len(self.fleets['rds'])}
+        if product == 'redis':
+            items = [{'InstanceId': id, 'InstanceName': 'redis-%s' % id}
+                     for id in self.page(self.fleets['redis'], number, size)]
+            return {'Instances': {'KVStoreInstance': items}, 'TotalCount': len(self.fleets['redis'])}
+        if product == 'slb':
+            items = [{'LoadBalancerId': id, 'LoadBalancerName': 'slb-%s' % id}
+                     for id in self.page(self.fleets['slb'], number, size)]
+            return {'LoadBalancers': {'LoadBalancer': items}, 'TotalCount': len(self.fleets['slb'])}
+        return {'Code': 'InvalidAction.NotFound', 'Message': 'unknown product %s' % product}
+
+    def es_instances(self, params: dict) -> dict:
+        number, size = int(params.get('PageNumber', 1)), int(params.get('size', 10))
+        items = [{'instanceId': id, 'description': 'es-%s' % id}
+                 for id in self.page(self.fleets['elasticsearch'], number, size)]
+        return {'Result': items}
+
+    def metric_last(self, params: dict) -> dict:
+        fleet = self.fleets.get(self.namespaces.get(params.get('Namespace'), None), [])
+        start = int(params.get('NextToken') or 0)
+        end = min(len(fleet), start + int(params.get('Length', 1000)))
+        now = int(time.time()) // 60 * 60 * 1000 - 60000
+        points = [{'timestamp': now, 'userId': '1', 'instanceId': id,
+                   'Average': (i % 100) / 1.0, 'Maximum': 100.0, 'Minimum': 0.0}
+                  for i, id in enumerate(fleet[start:end], start)]
+        data = {'Code': '200', 'Datapoints': json.dumps(points), 'RequestId': 'fake', 'Success': True}
+        if end < len(fleet):
+            data['NextToken'] = str(end)
+        return data
+
+
+def main():
+    '''
+    Serve a FakeAliyun until stdin is closed, its proxy url is the first line
+    printed. benchmarks.run starts it this way, so the fake's memory and CPU
+    don't count in the measurements of the exporter.
+    '''
+    parser = argparse.ArgumentParser(description='fake Aliyun API server')
+    parser.add_argument('--instances', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--throttle', type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeAliyun(args.instances, latency=args.latency, throttle=args.throttle).start()
+    print(fake.proxy, flush=True)
+    sys.stdin.read()
+    fake.stop()
+
+
+if __name__ == '__main__':
+    main()
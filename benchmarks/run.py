@@ -0,0 +1,209 @@
+'''
+Benchmark suite of the exporter against the local FakeAliyun server.
+
+Every scenario runs in its own process, so peak RSS is per scenario, and the
+fake server runs in yet another one, so its memory and CPU are not counted:
+
+    python -m benchmarks.run                      # the default suite
+    python -m benchmarks.run -s small -s throttled
+    python -m benchmarks.run -s small --instances 20000 --metrics 10 --latency 0.02
+    python -m benchmarks.run --json result.json
+    python -m benchmarks.run --baseline result.json --tolerance 0.2
+
+--instances, --metrics, --latency and --throttle override the parameters of
+every scenario which is run. Results are only compared with baseline results
+of the same parameters.
+
+With --baseline the run fails when a scenario is slower, uses more API calls
+or more memory than the baseline by more than the tolerance. Startup cost is
+measured by benchmarks.startup.
+'''
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import time
+from collections import Counter
+from urllib.request import ProxyHandler, build_opener
+
+SCENARIOS = {
+    'small': dict(instances=1000, metrics=5),
+    'medium': dict(instances=10000, metrics=5),
+    'large': dict(instances=50000, metrics=3),
+    'wide': dict(instances=1000, metrics=50),
+    'latency': dict(instances=5000, metrics=5, latency=0.05),
+    'throttled': dict(instances=5000, metrics=5, throttle=0.1),
+}
+DEFAULT_SUITE = ['small', 'medium', 'wide', 'latency', 'throttled']
+# lower is better for all of them
+COMPARED = ['cold_seconds', 'warm_seconds', 'api_calls', 'peak_rss_mb', 'cpu_us_per_series']
+PARAMETERS = ['instances', 'metrics', 'latency', 'throttle']
+
+
+def exporter_config(metrics: int, page_length: int = 1000) -> dict:
+    names = ['metric_%d' % i for i in range(metrics)]
+    namespaces = {
+        'acs_ecs_dashboard': 'ecs',
+        'acs_rds_dashboard': 'rds',
+        'acs_kvstore': 'redis',
+        'acs_slb_dashboard': 'slb',
+        'acs_elasticsearch': 'elasticsearch',
+    }
+    id_keys = {'ecs': 'InstanceId', 'rds': 'DBInstanceId', 'redis': 'InstanceId', 'slb': 'LoadBalancerId',
+               'elasticsearch': 'instanceId'}
+    return dict(
+        credential={'access_key_id': 'benchmark', 'access_key_secret': 'benchmark'},
+        protocol_type='http',
+        rate_limit=1000,
+        pool_size=20,
+        page_length=page_length,
+        cache_metrics=False,
+        empty_backoff=0,
+        info_metrics={resource: {} for resource in id_keys},
+        metrics={namespace: {
+            'metrics': [{'name': name} for name in names],
+            'extra_labels': {'fromInfo': resource, 'keys': {'instanceId': id_keys[resource]},
+                             'labels': [id_keys[resource]]},
+        } for namespace, resource in namespaces.items()},
+    )
+
+
+'''
+FakeProcess runs benchmarks.fake_aliyun in a child process.
+'''
+class FakeProcess():
+
+    def __init__(self, instances: int, latency: float = 0.0, throttle: float = 0.0):
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.fake_aliyun', '--instances', str(instances),
+             '--latency', str(latency), '--throttle', str(throttle)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.dirname(__file__)))
+        self.proxy = self.process.stdout.readline().decode('utf-8').strip()
+        self._opener = build_opener(ProxyHandler({}))
+
+    def reset_calls(self) -> Counter:
+        with self._opener.open(self.proxy + '/_calls') as resp:
+            return Counter(json.loads(resp.read().decode('utf-8')))
+
+    def stop(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def run_scenario(name: str, instances: int, metrics: int, latency: float = 0.0, throttle: float = 0.0,
+                 rounds: int = 3) -> dict:
+    fake = FakeProcess(instances, latency=latency, throttle=throttle)
+    os.environ['HTTP_PROXY'] = fake.proxy
+    os.environ.pop('http_proxy', None)
+
+    from aliyun_exporter.collector import AliyunCollector, CollectorConfig
+    from aliyun_exporter.exposition import ExpositionCache
+
+    try:
+        collector = AliyunCollector(CollectorConfig(**exporter_config(metrics)))
+        exposition = ExpositionCache(collector)
+        start = time.perf_counter()
+        body = exposition.render()
+        cold = time.perf_counter() - start
+        fake.reset_calls()
+        warm = []
+        cpu = time.process_time()
+        for _ in range(rounds):
+            start = time.perf_counter()
+            body = exposition.render()
+            warm.append(time.perf_counter() - start)
+        cpu = (time.process_time() - cpu) / rounds
+        calls = fake.reset_calls()
+    finally:
+        fake.stop()
+    series = sum(1 for line in body.splitlines() if line and not line.startswith(b'#'))
+    return {
+        'scenario': name,
+        'instances': instances,
+        'metrics': metrics,
+        'latency': latency,
+        'throttle': throttle,
+        'series': series,
+        'cold_seconds': round(cold, 3),
+        'warm_seconds': round(sorted(warm)[len(warm) // 2], 3),
+        'api_calls': sum(calls.values()) // rounds,
+        'throttled': throttle > 0,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'cpu_us_per_series': round(cpu / max(1, series) * 1e6, 2),
+    }
+
+
+def scenario(name: str, overrides: dict) -> dict:
+    params = dict(SCENARIOS[name])
+    params.update({k: v for k, v in overrides.items() if v is not None})
+    return params
+
+
+def spawn(name: str, overrides: dict = None) -> dict:
+    args = [sys.executable, '-m', 'benchmarks.run', '--child', name]
+    for key, value in (overrides or {}).items():
+        if value is not None:
+            args += ['--' + key, str(value)]
+    out = subprocess.run(args, check=True, stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.dirname(__file__)))
+    return json.loads(out.stdout.decode('utf-8').strip().splitlines()[-1])
+
+
+def regressions(results: list, baseline: list, tolerance: float, compared: list = COMPARED) -> list:
+    previous = {r['scenario']: r for r in baseline}
+    found = []
+    for result in results:
+        base = previous.get(result['scenario'], None)
+        if base is None or any(base.get(p, None) != result.get(p, None) for p in PARAMETERS):
+            continue
+        for key in compared:
+            if key == 'api_calls' and result.get('throttled', False):
+                continue
+            if base[key] > 0 and result[key] > base[key] * (1 + tolerance):
+                found.append('%s: %s %s -> %s' % (result['scenario'], key, base[key], result[key]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='aliyun-exporter benchmarks')
+    parser.add_argument('-s', '--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run, repeatable(default: %s)' % ', '.join(DEFAULT_SUITE))
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression ratio(default: 0.2)')
+    parser.add_argument('--instances', type=int, help='ECS instances of the fake fleet')
+    parser.add_argument('--metrics', type=int, help='metrics per namespace')
+    parser.add_argument('--latency', type=float, help='seconds every fake API response is delayed')
+    parser.add_argument('--throttle', type=float, help='ratio of fake API requests answered with Throttling')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    overrides = {key: getattr(args, key) for key in PARAMETERS}
+
+    if args.child:
+        logging.disable(logging.CRITICAL)
+        print(json.dumps(run_scenario(args.child, **scenario(args.child, overrides))))
+        return
+
+    results = []
+    columns = ['scenario', 'series', 'cold_seconds', 'warm_seconds', 'api_calls', 'peak_rss_mb', 'cpu_us_per_series']
+    print(' '.join('%18s' % c for c in columns))
+    for name in args.scenario or DEFAULT_SUITE:
+        result = spawn(name, overrides)
+        results.append(result)
+        print(' '.join('%18s' % result[c] for c in columns))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print('REGRESSION %s' % line)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''
+Startup benchmark: import time, collector construction time and RSS of a
+fresh exporter process, for a minimal and a full configuration.
+
+    python -m benchmarks.startup --json startup.json
+    python -m benchmarks.startup --baseline startup.json
+
+Every measurement is the median of `--rounds` fresh processes.
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from .run import exporter_config, regressions
+
+COMPARED = ['import_seconds', 'build_seconds', 'rss_mb']
+
+CHILD = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import aliyun_exporter
+from aliyun_exporter.collector import CollectorConfig, create_collector
+imported = time.perf_counter()
+collector = create_collector(CollectorConfig(**json.loads(sys.argv[1])))
+built = time.perf_counter()
+print(json.dumps({
+    'import_seconds': round(imported - start, 4),
+    'build_seconds': round(built - imported, 4),
+    'rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    'sdk_products': sorted({m.split('.')[0] for m in sys.modules if m.startswith('aliyunsdk')} - {'aliyunsdkcore'}),
+    'web_ui_loaded': 'flask' in sys.modules,
+}))
+'''
+
+
+def configs() -> dict:
+    full = exporter_config(metrics=5)
+    full['metrics']['rds_performance'] = [{'name': 'MySQL_NetworkTraffic'}]
+    minimal = exporter_config(metrics=5)
+    minimal['metrics'] = {'acs_ecs_dashboard': {'metrics': [{'name': 'CPUUtilization'}]}}
+    minimal['info_metrics'] = {}
+    return {'minimal': minimal, 'full': full}
+
+
+def measure(name: str, config: dict, rounds: int) -> dict:
+    results = []
+    for _ in range(rounds):
+        out = subprocess.run([sys.executable, '-c', CHILD, json.dumps(config)], check=True,
+                             stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.dirname(__file__)))
+        results.append(json.loads(out.stdout.decode('utf-8').strip().splitlines()[-1]))
+    result = dict(results[0], scenario=name)
+    for key in COMPARED:
+        result[key] = sorted(r[key] for r in results)[len(results) // 2]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='aliyun-exporter startup benchmark')
+    parser.add_argument('--rounds', type=int, default=5, help='processes per configuration(default: 5)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression ratio(default: 0.2)')
+    args = parser.parse_args()
+
+    results = []
+    columns = ['scenario'] + COMPARED + ['web_ui_loaded', 'sdk_products']
+    print(' '.join('%16s' % c for c in columns))
+    for name, config in configs().items():
+        result = measure(name, config, args.rounds)
+        results.append(result)
+        print(' '.join('%16s' % (result[c] if c != 'sdk_products' else ','.join(result[c]) or '-')
+                       for c in columns))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance, COMPARED)
+        for line in found:
+            print('REGRESSION %s' % line)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -21,10 +21,14 @@ setup(
         'Topic :: System :: Monitoring',
         'License :: OSI Approved :: Apache Software License',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
+    python_requires='>=3.8',
     keywords='monitoring prometheus exporter aliyun alibaba cloudmonitor',
-    packages=find_packages(exclude=['tests']),
+    packages=find_packages(exclude=['tests', 'benchmarks']),
     include_package_data=True,
     zip_safe=False,
     package_data={'aliyun_exporter': ['static/*','templates/*']},
@@ -33,16 +37,18 @@ setup(
         'aliyun-python-sdk-cms==7.0.21',
         'aliyun-python-sdk-core-v3==2.13.32',
         'pyyaml',
-        'ratelimit',
         'flask>1',
         'cachetools',
-        'tornado',
+        'tornado>=6.3',
         'aliyun-python-sdk-ecs==4.24.2',
         'aliyun-python-sdk-rds==2.5.11',
         'aliyun-python-sdk-r-kvstore==2.18.1',
         'aliyun-python-sdk-slb==3.3.7',
         "aliyun-python-sdk-dds==3.5.3",
     ],
+    extras_require={
+        'aio': ['aiohttp'],
+    },
     entry_points={
         'console_scripts': [
             'aliyun-exporter=aliyun_exporter:main',